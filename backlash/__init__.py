@@ -1,3 +1,28 @@
-from backlash.debug import DebuggedApplication
-from backlash.tracing.errors import TraceErrorsMiddleware
-from backlash.tracing.slowrequests import TraceSlowRequestsMiddleware
\ No newline at end of file
+"""The middlewares are imported on first access, so that using the tracing
+middlewares doesn't load the interactive debugger and its dependencies.
+"""
+import importlib
+
+_exports = {
+    'DebuggedApplication': 'backlash.debug',
+    'TraceErrorsMiddleware': 'backlash.tracing.errors',
+    'TraceSlowRequestsMiddleware': 'backlash.tracing.slowrequests',
+    'ProfilingMiddleware': 'backlash.tracing.profiling',
+    'MemoryGrowthMiddleware': 'backlash.tracing.profiling',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    try:
+        module = _exports[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
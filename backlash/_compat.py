@@ -72,7 +72,10 @@ else: # pragma: no cover
     raise exc_info[0], exc_info[1], exc_info[2]
 """)
 
-try:
-    from urllib2 import urlopen
-except ImportError:
-    from urllib.request import urlopen
+def urlopen(*args, **kwargs):
+    # urllib is imported on first use, as it's slow to import.
+    try:
+        from urllib2 import urlopen as _urlopen
+    except ImportError:
+        from urllib.request import urlopen as _urlopen
+    return _urlopen(*args, **kwargs)
@@ -0,0 +1,94 @@
+"""ASGI support for the interactive debugger."""
+import asyncio
+import io
+import sys
+from urllib.parse import parse_qs
+
+from backlash.debug import DebuggedApplication
+from backlash.tbtools import get_current_traceback
+from backlash.utils import RequestContext, environ_from_scope
+
+import logging
+log = logging.getLogger('backlash')
+
+
+class ASGIDebuggedApplication(DebuggedApplication):
+    """ASGI version of :class:`backlash.debug.DebuggedApplication`.
+
+    Debugger and console requests are served by the WSGI implementation
+    in the event loop default executor, so that console commands never
+    block the event loop.  The context injectors receive the ASGI scope
+    instead of the WSGI environ.
+    """
+
+    def _is_debugger_request(self, environ):
+        if parse_qs(environ['QUERY_STRING']).get('__debugger__', [None])[-1] == 'yes':
+            return True
+        return self.evalex and self.console_path is not None and \
+            environ['PATH_INFO'] == self.console_path
+
+    def _serve_wsgi(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                                   for k, v in headers]
+
+        environ.update({'wsgi.input': io.BytesIO(b''), 'wsgi.errors': sys.stderr})
+        body = b''.join(DebuggedApplication.__call__(self, environ, start_response))
+        return response['status'], response['headers'], body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        environ = environ_from_scope(scope)
+        if self._is_debugger_request(environ):
+            loop = asyncio.get_running_loop()
+            status, headers, body = await loop.run_in_executor(None, self._serve_wsgi, environ)
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': body})
+            return
+
+        await self.debug_application(scope, receive, send, environ)
+
+    async def debug_application(self, scope, receive, send, environ):
+        """Run the application and conserve the traceback frames."""
+        response_started = False
+
+        async def _send(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception:
+            context = RequestContext({'environ': self.environ_policy.snapshot(environ)})
+            for injector in self.context_injectors:
+                context.update(injector(scope))
+
+            traceback = get_current_traceback(skip=1, show_hidden_frames=self.show_hidden_frames,
+                                              context=context)
+            self._store_traceback(traceback)
+
+            log.debug(traceback.plaintext)
+            traceback.log(sys.stderr)
+
+            if response_started:
+                log.error('Debugging middleware caught exception in streamed '
+                          'response at a point where response headers were already sent.')
+                raise
+
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'text/html; charset=utf-8'),
+                                    # Disable Chrome's XSS protection, the debug
+                                    # output can cause false-positives.
+                                    (b'x-xss-protection', b'0')]})
+            await send({'type': 'http.response.body',
+                        'body': traceback.render_full(
+                            evalex=self.evalex,
+                            secret=self.secret
+                        ).encode('utf-8', 'replace')})
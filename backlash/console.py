@@ -10,20 +10,28 @@
 """
 import sys
 import code
+from collections import ChainMap
 from types import CodeType
 import threading
 
-from backlash._compat import exec_, text_, binary_type
-from backlash.utils import escape
-from backlash.repr import debug_repr, dump, helper
+from backlash._compat import exec_, text_, binary_type, text_type
+from backlash.utils import escape, gen_salt
+from backlash.repr import DebugReprGenerator, dump, helper
 
 _local = threading.local()
 
 class HTMLStringO(object):
-    """A StringO version that HTML escapes on write."""
+    """A StringO version that HTML escapes the output when it's fetched.
 
-    def __init__(self):
+    When ``limit`` is provided, the captured output is truncated after
+    ``limit`` characters to prevent huge outputs from exhausting memory.
+    """
+
+    def __init__(self, limit=None):
         self._buffer = []
+        self._size = 0
+        self.limit = limit
+        self.truncated = False
 
     def isatty(self):
         return False
@@ -40,34 +48,71 @@ class HTMLStringO(object):
     def readline(self):
         if len(self._buffer) == 0:
             return ''
-        ret = self._buffer[0]
+        ret = self._buffer[0][0]
         del self._buffer[0]
         return ret
 
     def reset(self):
-        val = ''.join(self._buffer)
+        chunks = []
+        text = []
+        for value, is_html in self._buffer:
+            if is_html:
+                chunks.append(escape(''.join(text)))
+                chunks.append(value)
+                del text[:]
+            else:
+                text.append(value)
+        chunks.append(escape(''.join(text)))
+        if self.truncated:
+            chunks.append('<span class="truncated">[output truncated]</span>\n')
+
         del self._buffer[:]
-        return val
+        self._size = 0
+        self.truncated = False
+        return ''.join(chunks)
 
-    def _write(self, x):
+    def available(self):
+        """Characters that can still be written, ``None`` when unlimited."""
+        if self.limit is None:
+            return None
+        return max(self.limit - self._size, 0)
+
+    def _append(self, x, is_html):
         if isinstance(x, binary_type):
             x = text_(x, 'utf-8', 'replace')
-        self._buffer.append(x)
+
+        if self.limit is not None:
+            available = self.limit - self._size
+            if len(x) > available:
+                self.truncated = True
+                if is_html or available <= 0:
+                    # markup can't be cut without breaking the page.
+                    return
+                x = x[:available]
+
+        self._size += len(x)
+        self._buffer.append((x, is_html))
+
+    def _write(self, x):
+        """Write already escaped HTML"""
+        self._append(x, True)
 
     def write(self, x):
-        self._write(escape(x))
+        if not isinstance(x, (text_type, binary_type)):
+            x = text_type(x)
+        self._append(x, False)
 
     def writelines(self, x):
-        self._write(escape(''.join(x)))
+        self.write(''.join(x))
 
 
 class ThreadedStream(object):
     """Thread-local wrapper for sys.stdout for the interactive console."""
 
-    def push():
+    def push(limit=None):
         if not isinstance(sys.stdout, ThreadedStream):
             sys.stdout = ThreadedStream()
-        _local.stream = HTMLStringO()
+        _local.stream = HTMLStringO(limit)
     push = staticmethod(push)
 
     def fetch():
@@ -83,10 +128,18 @@ class ThreadedStream(object):
             stream = _local.stream
         except AttributeError:
             return _displayhook(obj)
-            # stream._write bypasses escaping as debug_repr is
+        # stream._write bypasses escaping as debug_repr is
         # already generating HTML for us.
         if obj is not None:
-            stream._write(debug_repr(obj))
+            available = stream.available()
+            if available is not None:
+                # Stop rendering once the output would be over the limit,
+                # leaving room for the markup closing the repr.
+                available = max(available - 512, 0)
+            generator = DebugReprGenerator(available)
+            stream._write(generator.repr(obj))
+            if generator.truncated:
+                stream.truncated = True
     displayhook = staticmethod(displayhook)
 
     def __setattr__(self, name, value):
@@ -108,9 +161,15 @@ class ThreadedStream(object):
         return repr(sys.__stdout__)
 
 
-# add the threaded stream as display hook
-_displayhook = sys.displayhook
-sys.displayhook = ThreadedStream.displayhook
+_displayhook = None
+
+
+def _install_displayhook():
+    """Add the threaded stream as display hook, once the first console starts."""
+    global _displayhook
+    if _displayhook is None:
+        _displayhook = sys.displayhook
+        sys.displayhook = ThreadedStream.displayhook
 
 
 class _ConsoleLoader(object):
@@ -141,11 +200,39 @@ def _wrap_compiler(console):
     console.compile = func
 
 
+class _GlobalsOverlay(dict):
+    """Copy on write view of the globals of a frame.
+
+    Names assigned in the console are stored in the overlay itself while
+    lookups of missing names fall back to the original globals, so that
+    modules with large globals don't need to be copied for each console.
+    """
+
+    def __init__(self, base):
+        dict.__init__(self)
+        self.base = base
+
+    def __missing__(self, key):
+        return self.base[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.base
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
 class _InteractiveConsole(code.InteractiveInterpreter):
 
     def __init__(self, globals, locals, context):
-        code.InteractiveInterpreter.__init__(self, locals)
-        self.globals = dict(globals)
+        _install_displayhook()
+        self.globals = _GlobalsOverlay(globals)
+        # Names at the top level of the console are resolved through
+        # the locals, chaining the globals makes them visible there too.
+        code.InteractiveInterpreter.__init__(self, ChainMap(locals, self.globals))
         self.globals['dump'] = dump
         self.globals['help'] = helper
         self.globals['ctx'] = context
@@ -154,9 +241,9 @@ class _InteractiveConsole(code.InteractiveInterpreter):
         self.buffer = []
         _wrap_compiler(self)
 
-    def runsource(self, source):
+    def runsource(self, source, output_limit=None):
         source = source.rstrip() + '\n'
-        ThreadedStream.push()
+        ThreadedStream.push(output_limit)
         prompt = self.more and '... ' or '>>> '
         try:
             source_to_eval = ''.join(self.buffer + [source])
@@ -174,7 +261,8 @@ class _InteractiveConsole(code.InteractiveInterpreter):
     def runcode(self, code):
         try:
             exec_(code, self.globals, self.locals)
-        except Exception:
+        except (Exception, KeyboardInterrupt):
+            # KeyboardInterrupt is raised when the command gets interrupted.
             self.showtraceback()
 
     def showtraceback(self):
@@ -201,8 +289,170 @@ class Console(object):
             globals = {}
         self._ipy = _InteractiveConsole(globals, locals, context)
 
-    def eval(self, code):
-        return self._ipy.runsource(code)
+    def eval(self, code, output_limit=None):
+        return self._ipy.runsource(code, output_limit)
+
+
+def _set_async_exc(thread_id, exc):
+    import ctypes
+    return ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc) if exc is not None else None
+    )
+
+
+class ConsoleJob(object):
+    """A console command submitted to the :class:`ConsoleExecutor`."""
+
+    def __init__(self, console, code, output_limit=None):
+        self.id = gen_salt(16)
+        self.console = console
+        self.code = code
+        self.output_limit = output_limit
+        self.result = None
+        self.thread_id = None
+        self._state = threading.Lock()
+        self._interrupted = False
+        self._done = threading.Event()
+
+    def run(self):
+        with self._state:
+            self.thread_id = threading.current_thread().ident
+        try:
+            self.result = self.console.eval(self.code, self.output_limit)
+        except KeyboardInterrupt:
+            self.result = '%s\n[interrupted]\n' % escape(self.code)
+        finally:
+            self.complete()
+
+    def complete(self):
+        """Mark the job as completed, no interruption is sent afterwards.
+
+        It's safe to call it again if an interruption sent while the job
+        was completing got raised by it.
+        """
+        with self._state:
+            if self.thread_id is not None and self._interrupted:
+                # Discard an interruption not yet delivered to the thread.
+                _set_async_exc(self.thread_id, None)
+            self.thread_id = None
+        if self.result is None:
+            self.result = '%s\n[interrupted]\n' % escape(self.code)
+        self._done.set()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for the command to complete, returns ``True`` if it did."""
+        return self._done.wait(timeout)
+
+    def interrupt(self):
+        """Raise a KeyboardInterrupt in the thread running the command."""
+        with self._state:
+            if self.thread_id is None:
+                # Not started yet or already completed.
+                return False
+            self._interrupted = True
+            return _set_async_exc(self.thread_id, KeyboardInterrupt) == 1
+
+
+class ConsoleBusy(Exception):
+    """Raised when the console executor can't accept more commands."""
+
+
+class ConsoleExecutor(object):
+    """Runs console commands on a small pool of dedicated threads.
+
+    Commands are kept out of the web server threads, so that a command that
+    never completes doesn't block the application.  At most ``workers``
+    commands run at the same time and up to ``max_pending`` more can wait
+    for a free worker, further commands are rejected with :class:`ConsoleBusy`.
+
+    Commands of the same console run one at a time, in the order they
+    were submitted, as the state of a console is not thread safe.
+    """
+
+    #: Completed jobs nobody fetched are forgotten past this number of jobs.
+    MAX_JOBS = 64
+
+    def __init__(self, workers=2, max_pending=8, output_limit=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.output_limit = output_limit
+
+        self.jobs = {}
+        self._queue = []
+        self._threads = []
+        self._busy = set()
+        self._lock = threading.Condition()
+
+    def submit(self, console, code):
+        """Schedule ``code`` for execution in ``console``, returns a :class:`ConsoleJob`"""
+        job = ConsoleJob(console, code, self.output_limit)
+        with self._lock:
+            if len(self._queue) >= self.max_pending:
+                raise ConsoleBusy('Too many console commands are still running')
+
+            if len(self.jobs) >= self.MAX_JOBS:
+                for job_id in [j.id for j in self.jobs.values() if j.done]:
+                    del self.jobs[job_id]
+
+            self.jobs[job.id] = job
+            self._queue.append(job)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='backlash-console')
+                thread.daemon = True
+                self._threads.append(thread)
+                thread.start()
+            self._lock.notify()
+        return job
+
+    def pop(self, job_id):
+        """Return the job with the given id, forgetting it when it's done."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is not None and job.done:
+                del self.jobs[job_id]
+        return job
+
+    def _next_job(self):
+        # Must be called with the lock held.
+        for idx, job in enumerate(self._queue):
+            if id(job.console) not in self._busy:
+                self._busy.add(id(job.console))
+                return self._queue.pop(idx)
+        return None
+
+    def _work(self):
+        try:
+            while True:
+                with self._lock:
+                    job = self._next_job()
+                    while job is None:
+                        self._lock.wait()
+                        job = self._next_job()
+                try:
+                    self._run(job)
+                finally:
+                    with self._lock:
+                        self._busy.discard(id(job.console))
+                        self._lock.notify_all()
+        finally:
+            with self._lock:
+                self._threads.remove(threading.current_thread())
+
+    def _run(self, job):
+        try:
+            job.run()
+        except KeyboardInterrupt:
+            # Interruption delivered while the job was already completing.
+            while True:
+                try:
+                    job.complete()
+                    break
+                except KeyboardInterrupt:
+                    continue
 
 class _ConsoleFrame(object):
     """Helper class so that we can reuse the frame console code for the
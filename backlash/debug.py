@@ -8,20 +8,27 @@
     :copyright: (c) 2011 by the Werkzeug Team, see AUTHORS for more details.
     :license: BSD.
 """
-import mimetypes
 import json
+from collections import OrderedDict
 from os.path import join, dirname, basename, isfile
 
 from webob import Request, Response
 
 from backlash.tbtools import get_current_traceback, render_console_html
-from backlash.console import Console
-from backlash.utils import gen_salt, RequestContext
+from backlash.console import Console, ConsoleExecutor, ConsoleBusy
+from backlash.utils import escape
+from backlash.utils import gen_salt, RequestContext, default_environ_policy
 
 import logging
 log = logging.getLogger('backlash')
 
 
+RUNNING_HTML = '''\
+<span class="running" data-job="%(job)s">[still running,
+<a href="#" class="interrupt">interrupt</a>]</span>
+'''
+
+
 class _ConsoleFrame(object):
     """Helper class so that we can reuse the frame console code for the
     standalone console.
@@ -52,21 +59,40 @@ class DebuggedApplication(object):
     :param show_hidden_frames: by default hidden traceback frames are skipped.
                                You can show them by setting this parameter
                                to `True`.
+    :param max_tracebacks: how many tracebacks are kept available for
+                           debugging, the oldest ones are discarded with
+                           their frames and consoles.
+    :param console_timeout: seconds a console command is waited for, after
+                            which the console is told that the command is
+                            still running and polls for its result.
+    :param console_workers: how many console commands can run concurrently.
+    :param console_output_limit: maximum number of characters of output
+                                 captured for a single console command.
+    :param environ_policy: the :class:`backlash.utils.EnvironSnapshotPolicy`
+                           deciding which environ entries are kept with
+                           the tracebacks.
     """
     def __init__(self, app, evalex=True, console_path='/__console__',
                  console_init_func=None, show_hidden_frames=False,
-                 lodgeit_url=None, context_injectors=None):
+                 lodgeit_url=None, context_injectors=None, max_tracebacks=100,
+                 console_timeout=5, console_workers=2,
+                 console_output_limit=512 * 1024, environ_policy=None):
         if not console_init_func:
             console_init_func = dict
         self.app = app
         self.evalex = evalex
         self.frames = {}
-        self.tracebacks = {}
+        self.tracebacks = OrderedDict()
+        self.max_tracebacks = max_tracebacks
         self.console_path = console_path
         self.console_init_func = console_init_func
         self.show_hidden_frames = show_hidden_frames
         self.secret = gen_salt(20)
         self.context_injectors = context_injectors or []
+        self.environ_policy = environ_policy or default_environ_policy
+        self.console_timeout = console_timeout
+        self.console_executor = ConsoleExecutor(workers=console_workers,
+                                                output_limit=console_output_limit)
 
         if lodgeit_url is not None:
             from warnings import warn
@@ -84,15 +110,13 @@ class DebuggedApplication(object):
                 if hasattr(app_iter, 'close'):
                     app_iter.close()
         except Exception:
-            context = RequestContext({'environ':dict(environ)})
+            context = RequestContext({'environ': self.environ_policy.snapshot(environ)})
             for injector in self.context_injectors:
                 context.update(injector(environ))
 
             traceback = get_current_traceback(skip=1, show_hidden_frames=self.show_hidden_frames,
                                               context=context)
-            for frame in traceback.frames:
-                self.frames[frame.id] = frame
-            self.tracebacks[traceback.id] = traceback
+            self._store_traceback(traceback)
 
             try:
                 start_response('500 INTERNAL SERVER ERROR', [
@@ -122,9 +146,43 @@ class DebuggedApplication(object):
             log.debug(traceback.plaintext)
             traceback.log(environ['wsgi.errors'])
 
+    def _store_traceback(self, traceback):
+        """Keep the traceback and its frames available for debugging."""
+        for frame in traceback.frames:
+            self.frames[frame.id] = frame
+        self.tracebacks[traceback.id] = traceback
+
+        while len(self.tracebacks) > self.max_tracebacks:
+            _, evicted = self.tracebacks.popitem(last=False)
+            for frame in evicted.frames:
+                # Identifiers might have been reused by a newer frame.
+                if self.frames.get(frame.id) is frame:
+                    del self.frames[frame.id]
+
     def execute_command(self, request, command, frame):
         """Execute a command in a console."""
-        return Response(frame.console.eval(command), content_type='text/html')
+        try:
+            job = self.console_executor.submit(frame.console, command)
+        except ConsoleBusy as e:
+            return Response('<span class="busy">%s</span>\n' % escape(e),
+                            content_type='text/html')
+        return self._command_response(job, self.console_timeout)
+
+    def poll_command(self, request, job_id):
+        """Return the result of a command that was still running."""
+        job = self.console_executor.pop(job_id)
+        if job is None:
+            return Response('Not Found', status=404)
+        if request.GET.get('interrupt') == 'yes':
+            job.interrupt()
+        # Polls are answered quickly to avoid keeping server threads busy.
+        return self._command_response(job, min(self.console_timeout, 1))
+
+    def _command_response(self, job, timeout):
+        if not job.wait(timeout):
+            return Response(RUNNING_HTML % {'job': job.id}, content_type='text/html')
+        self.console_executor.pop(job.id)
+        return Response(job.result, content_type='text/html')
 
     def display_console(self, request):
         """Display a standalone shell."""
@@ -146,6 +204,7 @@ class DebuggedApplication(object):
         """Return a static resource from the shared folder."""
         filename = join(dirname(__file__), 'statics', basename(filename))
         if isfile(filename):
+            import mimetypes
             mimetype = mimetypes.guess_type(filename)[0]\
             or 'application/octet-stream'
             f = open(filename, 'rb')
@@ -177,6 +236,8 @@ class DebuggedApplication(object):
                 frm = int(frm)
             frame = self.frames.get(frm)
 
+            job = request.GET.get('job')
+
             if cmd == 'resource' and arg:
                 response = self.get_resource(request, arg)
             elif cmd == 'paste' and traceback is not None and\
@@ -184,6 +245,8 @@ class DebuggedApplication(object):
                 response = self.paste_traceback(request, traceback)
             elif cmd == 'source' and frame and self.secret == secret:
                 response = self.get_source(request, frame)
+            elif self.evalex and job is not None and self.secret == secret:
+                response = self.poll_command(request, job)
             elif self.evalex and cmd is not None and frame is not None and\
                  self.secret == secret:
                 response = self.execute_command(request, cmd, frame)
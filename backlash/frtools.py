@@ -1,27 +1,270 @@
-import sys, inspect
+import sys, os, inspect, threading, sysconfig
 from .tbtools import Traceback, Frame
+from ._compat import text_
 
 
 class DumpThread(Exception):
     backlash_event = True
 
 
-def get_thread_stack(thread_id, description='', error_type=DumpThread, context=None):
+def _get_error_type(error_type):
     if isinstance(error_type, str):
         error_type = type(error_type, (DumpThread,), {})
         # Hack to prevent traceback module from printing
         # backlash.frtools.ExceptionName instead of just ExceptionName
         error_type.__module__ = '__main__'
+    return error_type
 
-    e = error_type(description)
-    tb = Traceback(error_type, e, [], context=context)
 
-    f = sys._current_frames()[thread_id]
-    n = 0
+def _collect_frames(f, error_type, e, context):
+    frames = []
     while f is not None:
         if inspect.isframe(f):
-            tb.frames.insert(0, Frame(error_type, e, f, context))
+            frames.append(Frame(error_type, e, f, context))
         f = f.f_back
-        n += 1
+    frames.reverse()
+    return frames
+
+
+def get_frame_stack(f, description='', error_type=DumpThread, context=None):
+    """Build a traceback from frame ``f`` and its callers."""
+    error_type = _get_error_type(error_type)
+
+    e = error_type(description)
+    tb = Traceback(error_type, e, [], context=context)
+    tb.frames = _collect_frames(f, error_type, e, context)
+    return tb
+
+
+def get_thread_stack(thread_id, description='', error_type=DumpThread, context=None):
+    error_type = _get_error_type(error_type)
+
+    e = error_type(description)
+    tb = Traceback(error_type, e, [], context=context)
+    tb.frames = _collect_frames(sys._current_frames()[thread_id], error_type, e, context)
+    return tb
+
+
+class _GreenletStack(object):
+    """Stack handle of code running in a greenlet.
+
+    Keeps the greenlet and the OS thread it runs into, as the greenlet
+    has no frame of its own while it's the one running.
+    """
+    __slots__ = ('greenlet', 'thread_id')
+
+    def __init__(self, greenlet, thread_id):
+        self.greenlet = greenlet
+        self.thread_id = thread_id
+
+    def __repr__(self):
+        return '<greenlet 0x%x in thread %s>' % (id(self.greenlet), self.thread_id)
+
+
+def _detect_greenlet_backend():
+    """Return ``(getcurrent, get_ident)`` if threads are monkey patched as greenlets."""
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            from greenlet import getcurrent
+            return getcurrent, monkey.get_original('_thread', 'get_ident')
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            from greenlet import getcurrent
+            return getcurrent, patcher.original('_thread').get_ident
+    return None
+
+
+_greenlet_backend = None
+
+
+def _get_greenlet_backend():
+    global _greenlet_backend
+    if _greenlet_backend is None:
+        # Monkey patching happens at startup, detecting it once is enough.
+        _greenlet_backend = _detect_greenlet_backend() or False
+    return _greenlet_backend
+
+
+def get_thread_id():
+    """Identifier of the OS thread running the caller, even when monkey patched."""
+    backend = _get_greenlet_backend()
+    if backend:
+        return backend[1]()
+    return threading.current_thread().ident
+
+
+def get_stack_handle():
+    """Handle to capture later the stack of the caller with :func:`get_handle_stack`.
+
+    Under gevent or eventlet many requests share the same OS thread, so the
+    current greenlet is recorded, otherwise it's the current thread id.
+    """
+    backend = _get_greenlet_backend()
+    if backend:
+        getcurrent, get_ident = backend
+        return _GreenletStack(getcurrent(), get_ident())
+    return threading.current_thread().ident
+
+
+def get_greenlet_frame(handle):
+    """Current frame of the greenlet recorded by a stack handle.
+
+    Raises ``KeyError`` if the greenlet finished in the mean time.
+    """
+    glet = handle.greenlet
+    if glet.dead:
+        raise KeyError(handle)
+    f = glet.gr_frame
+    if f is None:
+        # Greenlets have no saved frame while running, get it from their thread.
+        f = sys._current_frames()[handle.thread_id]
+    return f
+
 
+def get_handle_stack(handle, description='', error_type=DumpThread, context=None):
+    """Capture the stack identified by a handle from :func:`get_stack_handle`
+
+    asyncio tasks are accepted as handles too.
+    """
+    if hasattr(handle, 'get_stack'):
+        return get_task_stack(handle, description, error_type, context)
+    elif not isinstance(handle, _GreenletStack):
+        return get_thread_stack(handle, description, error_type, context)
+
+    error_type = _get_error_type(error_type)
+
+    e = error_type(description)
+    tb = Traceback(error_type, e, [], context=context)
+    tb.frames = _collect_frames(get_greenlet_frame(handle), error_type, e, context)
+    return tb
+
+
+def get_task_stack(task, description='', error_type=DumpThread, context=None):
+    """Capture the stack of an asyncio task.
+
+    ``Task.get_stack`` only provides the outermost frame of a suspended
+    coroutine, the coroutines it is awaiting are followed to reach the
+    innermost frame.
+    """
+    error_type = _get_error_type(error_type)
+
+    e = error_type(description)
+    tb = Traceback(error_type, e, [], context=context)
+
+    frames = task.get_stack()
+    awaiting = getattr(task.get_coro(), 'cr_await', None)
+    while awaiting is not None:
+        f = getattr(awaiting, 'cr_frame', None) or getattr(awaiting, 'gi_frame', None)
+        if f is not None:
+            frames.append(f)
+        awaiting = getattr(awaiting, 'cr_await', None) or getattr(awaiting, 'gi_yieldfrom', None)
+
+    tb.frames = [Frame(error_type, e, f, context) for f in frames if inspect.isframe(f)]
     return tb
+
+
+_library_paths = None
+
+
+def is_library_frame(frame):
+    """Whether the frame belongs to the standard library, an installed
+    package or backlash itself instead of the application.
+    """
+    global _library_paths
+    if _library_paths is None:
+        paths = sysconfig.get_paths()
+        _library_paths = tuple(set(os.path.realpath(paths[k]) + os.sep for k in
+                                   ('stdlib', 'platstdlib', 'purelib', 'platlib') if k in paths))
+        _library_paths += (os.path.dirname(os.path.abspath(__file__)) + os.sep, )
+    filename = frame.filename
+    return filename.startswith('<') or filename.startswith(_library_paths)
+
+
+def stack_fingerprint(frames, depth=5):
+    """Identifies stacks that are at the same point of the application.
+
+    Made of the innermost ``depth`` frames of the application, so that
+    threads waiting on the same lock from the same place share it.
+    """
+    application = [f for f in frames if not is_library_frame(f)] or frames
+    return tuple((f.filename, f.function_name, f.lineno) for f in application[-depth:])
+
+
+class StackDump(Traceback):
+    """Stacks of multiple threads reported as a single traceback.
+
+    ``stacks`` is a list of ``(label, traceback)`` tuples, the plain text
+    version of the dump includes all of them with their label.
+    """
+
+    def __init__(self, stacks, description='', error_type='StackDump', context=None):
+        error_type = _get_error_type(error_type)
+        super(StackDump, self).__init__(error_type, error_type(description), [],
+                                        context=context)
+        self.stacks = stacks
+
+    def generate_plaintext_traceback(self):
+        for label, tb in self.stacks:
+            yield text_('%s' % label)
+            # Skip the traceback header and exception, the label replaces them.
+            for line in list(tb.generate_plaintext_traceback())[1:-1]:
+                yield line
+            yield text_('')
+        yield text_(self.exception)
+
+
+def dump_threads(registry=None, description='', error_type='ThreadsDump',
+                 context=None, current_frame=None):
+    """Dump the stack of every thread of the process as a :class:`StackDump`.
+
+    All the stacks come from the same ``sys._current_frames()`` snapshot,
+    threads serving a request tracked by ``registry`` are labelled with it.
+    The thread calling the function is excluded, unless ``current_frame``
+    provides the frame it should be dumped from (like in signal handlers).
+    """
+    current_frames = sys._current_frames()
+    current_thread = get_thread_id()
+    if current_frame is not None:
+        current_frames[current_thread] = current_frame
+    else:
+        current_frames.pop(current_thread, None)
+
+    error_type = _get_error_type(error_type)
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    requests = registry.by_thread() if registry is not None else {}
+
+    stacks = []
+    for thread_id, f in current_frames.items():
+        thread_requests = [r for r in requests.get(thread_id, [])
+                           if not isinstance(r.task, _GreenletStack) or r.task.greenlet.gr_frame is None]
+        label = 'Thread %s (%s): %s' % (
+            thread_id, names.get(thread_id, 'unknown'),
+            '; '.join(r.describe() for r in thread_requests) or 'no request'
+        )
+        stacks.append(_labelled_stack(label, f, thread_requests, error_type, context))
+
+    # Requests served by suspended greenlets don't appear among the threads.
+    for thread_requests in requests.values():
+        for request in thread_requests:
+            if not isinstance(request.task, _GreenletStack):
+                continue
+            f = request.task.greenlet.gr_frame
+            if f is None:
+                continue
+            label = 'Greenlet 0x%x in thread %s: %s' % (id(request.task.greenlet),
+                                                        request.thread_id, request.describe())
+            stacks.append(_labelled_stack(label, f, [request], error_type, context))
+
+    stacks.sort(key=lambda s: s[0])
+    return StackDump([s[1:] for s in stacks], description, error_type, context)
+
+
+def _labelled_stack(label, f, requests, error_type, context):
+    e = error_type(label)
+    tb = Traceback(error_type, e, [], context=context)
+    tb.frames = _collect_frames(f, error_type, e, context)
+    # Threads serving requests first, the oldest ones on top.
+    started = min([r.started for r in requests] or [float('inf')])
+    return started, label, tb
@@ -0,0 +1,155 @@
+"""Replay requests captured by :class:`backlash.tracing.reporters.capture.CaptureReporter`.
+
+Requests are sent in process to a WSGI application and the latency
+distribution of each route is reported, so that captured slow requests
+can be used as regression benchmarks::
+
+    python -m backlash.replay myapp.wsgi:application captures.jsonl --repeat 20
+"""
+import argparse
+import importlib
+import json
+import sys
+import time
+from collections import OrderedDict
+
+from backlash.tracing.capture import read_captures, build_environ
+
+
+def load_application(spec, factory=False):
+    """Load the WSGI application from a ``module:attribute`` specification."""
+    module_name, _, attribute = spec.partition(':')
+    app = getattr(importlib.import_module(module_name), attribute or 'application')
+    if factory:
+        app = app()
+    return app
+
+
+def replay_request(app, record):
+    """Send a captured request, returns the latency and if it failed."""
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+
+    started = time.perf_counter()
+    try:
+        app_iter = app(build_environ(record), start_response)
+        try:
+            for _ in app_iter:
+                pass
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+    except Exception:
+        return time.perf_counter() - started, True
+    elapsed = time.perf_counter() - started
+    return elapsed, not status or status[-1][:1] == '5'
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of already sorted ``values``."""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def skip_truncated(records, errors=sys.stderr):
+    """Leave out the records whose body was not captured entirely.
+
+    Their replay would send a different request, so they are reported as
+    skipped on ``errors``.
+    """
+    for record in records:
+        if record.get('body_truncated'):
+            errors.write('Skipping %s %s: its body was captured only partially\n' % (
+                record['method'], record['path']))
+            continue
+        yield record
+
+
+def replay(app, records, repeat=1, warmup=0):
+    """Replay the records, returns the statistics of each route."""
+    routes = OrderedDict()
+    for record in records:
+        route = routes.setdefault('%s %s' % (record['method'], record['path']), {
+            'latencies': [], 'errors': 0, 'captured': []
+        })
+        if record.get('duration') is not None:
+            route['captured'].append(record['duration'])
+
+        for _ in range(warmup):
+            replay_request(app, record)
+        for _ in range(repeat):
+            elapsed, failed = replay_request(app, record)
+            route['latencies'].append(elapsed)
+            route['errors'] += failed
+
+    stats = OrderedDict()
+    for name, route in routes.items():
+        latencies = sorted(route['latencies'])
+        if not latencies:
+            continue
+        captured = sorted(route['captured'])
+        stats[name] = {
+            'requests': len(latencies),
+            'errors': route['errors'],
+            'min': latencies[0],
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1],
+            'captured_p50': percentile(captured, 0.5) if captured else None
+        }
+    return stats
+
+
+def format_stats(stats):
+    lines = ['%-40s %8s %6s %10s %10s %10s %10s %10s' % (
+        'route', 'requests', 'errors', 'p50', 'p90', 'p99', 'max', 'captured'
+    )]
+    for name, s in stats.items():
+        captured = '-' if s['captured_p50'] is None else '%.2fms' % (s['captured_p50'] * 1000)
+        lines.append('%-40s %8d %6d %8.2fms %8.2fms %8.2fms %8.2fms %10s' % (
+            name[:40], s['requests'], s['errors'], s['p50'] * 1000, s['p90'] * 1000,
+            s['p99'] * 1000, s['max'] * 1000, captured
+        ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m backlash.replay',
+                                     description='Replay captured requests against a WSGI app.')
+    parser.add_argument('app', help='WSGI application as module:attribute')
+    parser.add_argument('captures', help='capture file written by CaptureReporter')
+    parser.add_argument('--factory', action='store_true',
+                        help='the attribute is a factory returning the application')
+    parser.add_argument('--repeat', type=int, default=1, help='times each request is replayed')
+    parser.add_argument('--warmup', type=int, default=0,
+                        help='replays of each request not accounted')
+    parser.add_argument('--kind', action='append',
+                        help='replay only reports of this kind, like SlowRequestError')
+    parser.add_argument('--truncated', action='store_true',
+                        help='replay also requests whose body was captured only partially')
+    parser.add_argument('--json', action='store_true', help='output the statistics as JSON')
+    options = parser.parse_args(argv)
+
+    sys.path.insert(0, '')
+    app = load_application(options.app, options.factory)
+    records = [r for r in read_captures(options.captures)
+               if not options.kind or r.get('kind') in options.kind]
+    if options.truncated:
+        if any(r.get('body_truncated') for r in records):
+            sys.stderr.write('Warning: replaying requests with partially captured bodies\n')
+    else:
+        records = list(skip_truncated(records))
+
+    stats = replay(app, records, options.repeat, options.warmup)
+    if options.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(format_stats(stats))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -44,9 +44,13 @@ OBJECT_DUMP_HTML = '''\
 '''
 
 
-def debug_repr(obj):
-    """Creates a debug repr of an object as HTML unicode string."""
-    return DebugReprGenerator().repr(obj)
+def debug_repr(obj, max_length=None):
+    """Creates a debug repr of an object as HTML unicode string.
+
+    When ``max_length`` is provided, rendering stops after about that many
+    characters, see :class:`DebugReprGenerator`.
+    """
+    return DebugReprGenerator(max_length).repr(obj)
 
 
 def dump(obj=missing):
@@ -101,16 +105,47 @@ def _add_subclass_info(inner, obj, bases):
     return '%s%s(%s)' % (module, obj.__class__.__name__, inner)
 
 
+TRUNCATED_HTML = '<span class="truncated">...</span>'
+
+
 class DebugReprGenerator(object):
+    """Generates the HTML debug repr of objects.
 
-    def __init__(self):
+    When ``max_length`` is provided the items of containers and the text of
+    strings past about ``max_length`` characters of output are left out
+    while rendering, so that huge objects don't need to be rendered whole
+    just to be cut.  ``truncated`` tells if anything was left out.
+    """
+
+    def __init__(self, max_length=None):
         self._stack = []
+        self.max_length = max_length
+        self.truncated = False
+        # Characters of output produced so far.
+        self._produced = 0
+
+    def _exhausted(self):
+        if self.max_length is not None and self._produced >= self.max_length:
+            self.truncated = True
+            return True
+        return False
+
+    def _cap(self, obj, limit):
+        """Cut ``obj`` to what fits in the remaining output, at least ``limit``."""
+        if self.max_length is None:
+            return obj
+        keep = max(limit, self.max_length - self._produced)
+        if len(obj) > keep:
+            self.truncated = True
+            return obj[:keep]
+        return obj
 
     def _sequence_repr_maker(left, right, base=object(), limit=8):
         def proxy(self, obj, recursive):
             if recursive:
                 return _add_subclass_info(left + '...' + right, obj, base)
             buf = [left]
+            start, size = self._produced, len(left)
             have_extended_section = False
             for idx, item in enumerate(obj):
                 if idx:
@@ -118,7 +153,14 @@ class DebugReprGenerator(object):
                 if idx == limit:
                     buf.append('<span class="extended">')
                     have_extended_section = True
-                buf.append(self.repr(item))
+                if self.max_length is not None:
+                    self._produced = start + size
+                    if self._exhausted():
+                        buf.append(TRUNCATED_HTML)
+                        break
+                item_repr = self.repr(item)
+                buf.append(item_repr)
+                size += len(item_repr) + 2
             if have_extended_section:
                 buf.append('</span>')
             buf.append(right)
@@ -165,7 +207,7 @@ class DebugReprGenerator(object):
 
     def py3_text_repr(self, obj, limit=70):
         buf = ['<span class="string">']
-        escaped = escape(obj)
+        escaped = escape(self._cap(obj, limit))
         a = repr(escaped[:limit])
         b = repr(escaped[limit:])
         if b != "''":
@@ -177,7 +219,7 @@ class DebugReprGenerator(object):
 
     def py3_binary_repr(self, obj, limit=70):
         buf = ['<span class="string">']
-        escaped = escape(text_(obj, 'utf-8', 'replace'))
+        escaped = escape(text_(self._cap(obj, limit), 'utf-8', 'replace'))
         a = repr(escaped[:limit])
         b = repr(escaped[limit:])
         buf.append('b')
@@ -192,6 +234,7 @@ class DebugReprGenerator(object):
         if recursive:
             return _add_subclass_info(text_('{...}'), d, dict)
         buf = ['{']
+        start, size = self._produced, 1
         have_extended_section = False
         for idx, (key, value) in enumerate(iteritems_(d)):
             if idx:
@@ -199,9 +242,15 @@ class DebugReprGenerator(object):
             if idx == limit - 1:
                 buf.append('<span class="extended">')
                 have_extended_section = True
-            buf.append('<span class="pair"><span class="key">%s</span>: '
-                       '<span class="value">%s</span></span>' %
-                       (self.repr(key), self.repr(value)))
+            if self.max_length is not None:
+                self._produced = start + size
+                if self._exhausted():
+                    buf.append(TRUNCATED_HTML)
+                    break
+            pair = ('<span class="pair"><span class="key">%s</span>: '
+                    '<span class="value">%s</span></span>' % (self.repr(key), self.repr(value)))
+            buf.append(pair)
+            size += len(pair) + 2
         if have_extended_section:
             buf.append('</span>')
         buf.append('}')
@@ -209,7 +258,7 @@ class DebugReprGenerator(object):
 
     def object_repr(self, obj):
         return text_('<span class="object">%s</span>' %
-                     escape(text_(repr(obj), 'utf-8', 'replace')))
+                     escape(self._cap(text_(repr(obj), 'utf-8', 'replace'), 70)))
 
     def dispatch_repr(self, obj, recursive):
         if obj is helper:
@@ -257,13 +306,16 @@ class DebugReprGenerator(object):
                 recursive = True
                 break
         self._stack.append(obj)
+        start = self._produced
         try:
             try:
-                return self.dispatch_repr(obj, recursive)
+                rv = self.dispatch_repr(obj, recursive)
             except Exception:
-                return self.fallback_repr()
+                rv = self.fallback_repr()
         finally:
             self._stack.pop()
+        self._produced = start + len(rv)
+        return rv
 
     def dump_object(self, obj):
         repr = items = None
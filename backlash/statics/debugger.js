@@ -132,26 +132,46 @@ function openShell(consoleNode, target, frameID) {
   var historyPos = 0, history = [''];
   var output = $('<div class="output">[console ready]</div>')
     .appendTo(consoleNode);
+  var showOutput = function(data, placeholder) {
+    var tmp = $('<div>').html(data);
+    $('span.extended', tmp).each(function() {
+      var hidden = $(this).wrap('<span>').hide();
+      hidden
+        .parent()
+        .append($('<a href="#" class="toggle">&nbsp;&nbsp;</a>')
+          .click(function() {
+            hidden.toggle();
+            $(this).toggleClass('open')
+            return false;
+          }));
+    });
+    $('span.running', tmp).each(function() {
+      var running = $(this), job = running.attr('data-job');
+      var poll = function(interrupt) {
+        $.get('', {__debugger__: 'yes', job: job, s: SECRET,
+                   interrupt: interrupt ? 'yes' : 'no'}, function(data) {
+          showOutput(data, running);
+        });
+      };
+      $('a.interrupt', running).click(function() {
+        poll(true);
+        return false;
+      });
+      setTimeout(function() { poll(false); }, 500);
+    });
+    if (placeholder)
+      placeholder.replaceWith(tmp);
+    else
+      output.append(tmp);
+    consoleNode.scrollTop(consoleNode.get(0).scrollHeight);
+  };
   var form = $('<form>&gt;&gt;&gt; </form>')
     .submit(function() {
       var cmd = command.val();
       $.get('', {
           __debugger__: 'yes', cmd: cmd, frm: frameID, s: SECRET}, function(data) {
-        var tmp = $('<div>').html(data);
-        $('span.extended', tmp).each(function() {
-          var hidden = $(this).wrap('<span>').hide();
-          hidden
-            .parent()
-            .append($('<a href="#" class="toggle">&nbsp;&nbsp;</a>')
-              .click(function() {
-                hidden.toggle();
-                $(this).toggleClass('open')
-                return false;
-              }));
-        });
-        output.append(tmp);
+        showOutput(data);
         command.focus();
-        consoleNode.scrollTop(consoleNode.get(0).scrollHeight);
         var old = history.pop();
         history.push(cmd);
         if (typeof old != 'undefined')
@@ -11,14 +11,16 @@
 import re
 import os
 import sys
+import ast
 import json
 import inspect
 import traceback
 import codecs
+import threading
+from collections import OrderedDict
 from tokenize import TokenError
 
 from backlash.utils import escape
-from backlash.console import Console
 
 from backlash._compat import PY2, text_, native_, string_types, text_type, exec_, urlopen
 
@@ -132,6 +134,119 @@ SOURCE_LINE_HTML = text_('''\
 ''')
 
 
+#: Maximum number of source files whose block index is kept in memory.
+SOURCE_INDEX_CACHE_SIZE = 64
+
+_source_index_cache = OrderedDict()
+_source_index_lock = threading.Lock()
+
+
+class SourceIndex(object):
+    """Block spans and rendered rows of a source file.
+
+    Maps the first line of every function, class and lambda to the span
+    of lines of its block, so that the source viewer doesn't need to
+    tokenize the rest of the module to highlight a single function.
+
+    ``mtime`` is the modification time of the file the index was built
+    from, ``None`` when the index can't be cached.
+    """
+
+    def __init__(self, lines, mtime=None):
+        self.lines = lines
+        self.mtime = mtime
+        self.spans = self._compute_spans(lines)
+        self._walked = {}
+        self._rendered = None
+
+    @staticmethod
+    def _compute_spans(lines):
+        try:
+            tree = ast.parse('\n'.join(lines))
+        except (SyntaxError, ValueError):
+            return None
+
+        spans = {}
+        for node in ast.walk(tree):
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                     ast.ClassDef, ast.Lambda)):
+                continue
+            decorators = getattr(node, 'decorator_list', None)
+            start = decorators and decorators[0].lineno or node.lineno
+            span = (start, node.end_lineno)
+            # ast.walk visits outer nodes first, so a lambda declared on the
+            # same line of a def doesn't replace the function span.
+            spans.setdefault(start, span)
+            spans.setdefault(node.lineno, span)
+        return spans
+
+    def block_span(self, firstlineno):
+        """Return the ``(first, last)`` 1-based lines of the block starting
+        at ``firstlineno`` or ``None`` if no block starts there.
+        """
+        if self.spans is not None and firstlineno in self.spans:
+            return self.spans[firstlineno]
+
+        # Module level code, comprehensions and sources that can't be parsed,
+        # look for the enclosing definition by hand.
+        try:
+            return self._walked[firstlineno]
+        except KeyError:
+            span = self._walked[firstlineno] = self._walk_span(firstlineno)
+            return span
+
+    def _walk_span(self, firstlineno):
+        if not self.lines:
+            return None
+        lineno = min(firstlineno, len(self.lines)) - 1
+        while lineno > 0:
+            if _funcdef_re.match(self.lines[lineno]):
+                break
+            lineno -= 1
+        try:
+            offset = len(inspect.getblock([x + '\n' for x
+                                           in self.lines[lineno:]]))
+        except TokenError:
+            return None
+        if not offset:
+            return None
+        return lineno + 1, lineno + offset
+
+    @property
+    def rendered(self):
+        """The rows of the source table with no line highlighted."""
+        if self._rendered is None:
+            self._rendered = [Line(idx + 1, x).render()
+                              for idx, x in enumerate(self.lines)]
+        return self._rendered
+
+
+def get_source_index(filename, load_lines):
+    """Return the :class:`SourceIndex` for ``filename``.
+
+    Indexes of files on disk are cached by modification time, ``load_lines``
+    is called to retrieve the source lines only when the cache is stale.
+    """
+    try:
+        mtime = os.stat(filename).st_mtime
+    except (OSError, TypeError, ValueError):
+        return SourceIndex(load_lines())
+
+    with _source_index_lock:
+        cached = _source_index_cache.get(filename)
+        if cached is not None and cached[0] == mtime:
+            _source_index_cache.move_to_end(filename)
+            return cached[1]
+
+    index = SourceIndex(load_lines(), mtime)
+    with _source_index_lock:
+        _source_index_cache[filename] = (mtime, index)
+        _source_index_cache.move_to_end(filename)
+        while len(_source_index_cache) > SOURCE_INDEX_CACHE_SIZE:
+            _source_index_cache.popitem(last=False)
+    return index
+
+
 def render_console_html(secret):
     return CONSOLE_HTML % {
         'evalex':           'true',
@@ -382,6 +497,9 @@ class Frame(object):
         self.module = self.globals.get('__name__')
         self.loader = self.globals.get('__loader__')
         self.code = tb_frame.f_code
+        self._rendered_source = None
+        self._source_index = None
+        self._console = None
 
         # support for paste's traceback extensions
         self.hide = self.locals.get('__traceback_hide__', False)
@@ -420,21 +538,13 @@ class Frame(object):
 
     def get_annotated_lines(self):
         """Helper function that returns lines with extra information."""
-        lines = [Line(idx + 1, x) for idx, x in enumerate(self.sourcelines)]
+        index = self.source_index
+        lines = [Line(idx + 1, x) for idx, x in enumerate(index.lines)]
 
         # find function definition and mark lines
-        if hasattr(self.code, 'co_firstlineno'):
-            lineno = self.code.co_firstlineno - 1
-            while lineno > 0:
-                if _funcdef_re.match(lines[lineno].code):
-                    break
-                lineno -= 1
-            try:
-                offset = len(inspect.getblock([x.code + '\n' for x
-                                               in lines[lineno:]]))
-            except TokenError:
-                offset = 0
-            for line in lines[lineno:lineno + offset]:
+        span = self._frame_span(index)
+        if span is not None:
+            for line in lines[span[0] - 1:span[1]]:
                 line.in_frame = True
 
         # mark current line
@@ -445,10 +555,46 @@ class Frame(object):
 
         return lines
 
+    @property
+    def frame_span(self):
+        """The ``(first, last)`` lines of the block the frame code belongs to."""
+        return self._frame_span(self.source_index)
+
+    def _frame_span(self, index):
+        firstlineno = getattr(self.code, 'co_firstlineno', None)
+        if firstlineno is None:
+            return None
+        return index.block_span(firstlineno)
+
     def render_source(self):
         """Render the sourcecode."""
-        return SOURCE_TABLE_HTML % text_('\n'.join(line.render() for line in
-            self.get_annotated_lines()))
+        if self._rendered_source is None:
+            index = self.source_index
+            rows = index.rendered
+            count = len(index.lines)
+
+            # Only the lines of the frame need to be rendered again,
+            # the rest of the table is shared by all the frames of the file.
+            first = last = self.lineno
+            span = self._frame_span(index)
+            if span is not None:
+                first, last = min(first, span[0]), max(last, span[1])
+            first, last = max(first, 1), min(last, count)
+
+            annotated = []
+            for lineno in range(first, last + 1):
+                line = Line(lineno, index.lines[lineno - 1])
+                line.in_frame = span is not None and span[0] <= lineno <= span[1]
+                line.current = lineno == self.lineno
+                annotated.append(line.render())
+
+            if first > last:
+                # Current line is out of the source, nothing to highlight.
+                table = rows
+            else:
+                table = rows[:first - 1] + annotated + rows[last:]
+            self._rendered_source = SOURCE_TABLE_HTML % text_('\n'.join(table))
+        return self._rendered_source
 
     def eval(self, code, mode='single'):
         """Evaluate code in the context of the frame."""
@@ -460,9 +606,30 @@ class Frame(object):
             return eval(code, self.globals, self.locals)
         exec_(code, self.globals, self.locals)
 
+    @property
+    def source_index(self):
+        """The :class:`SourceIndex` of the file the frame belongs to.
+
+        Indexes that can't be cached by file, like the ones of code typed
+        in the interactive console, are kept for the frame lifetime.
+        """
+        if self._source_index is not None:
+            return self._source_index
+        if self.loader is not None and hasattr(self.loader, 'get_source_by_code'):
+            # Code typed in the interactive console, has no file to cache on.
+            index = SourceIndex(self._read_sourcelines())
+        else:
+            index = get_source_index(self.filename, self._read_sourcelines)
+        if index.mtime is None:
+            self._source_index = index
+        return index
+
     @property
     def sourcelines(self):
         """The sourcecode of the file as list of unicode strings."""
+        return self.source_index.lines
+
+    def _read_sourcelines(self):
         # get sourcecode from loader or file
         source = None
         if self.loader is not None:
@@ -512,6 +679,17 @@ class Frame(object):
 
         return source.decode(charset, 'replace').splitlines()
 
+    def source_context(self, lines=5):
+        """The ``lines`` lines before the current line, the current
+        line and the ``lines`` lines after it.
+        """
+        sourcelines = self.sourcelines
+        idx = self.lineno - 1
+        if not 0 <= idx < len(sourcelines):
+            return [], text_(''), []
+        return (sourcelines[max(idx - lines, 0):idx], sourcelines[idx],
+                sourcelines[idx + 1:idx + 1 + lines])
+
     @property
     def current_line(self):
         try:
@@ -521,6 +699,13 @@ class Frame(object):
 
     @property
     def console(self):
-        return Console(self.globals, self.locals, self.context)
+        """The interactive console of the frame, kept for the frame lifetime
+        so that state is preserved between commands.
+        """
+        if self._console is None:
+            # The console is needed only by the interactive debugger.
+            from backlash.console import Console
+            self._console = Console(self.globals, self.locals, self.context)
+        return self._console
 
     id = property(lambda x: id(x))
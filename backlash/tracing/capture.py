@@ -0,0 +1,115 @@
+"""Capture format of reported requests, one JSON object per line.
+
+Each record holds what is needed to send the request again: method,
+path, query string, headers and the beginning of the body (when it was
+captured through the ``capture_body`` option of the middlewares, encoded
+as base64), along with the kind of report and the timings the request had.
+Records of bodies that were not captured entirely are flagged as truncated.
+"""
+import base64
+import io
+import json
+import time
+
+from backlash._compat import bytes_
+
+CAPTURE_VERSION = 2
+
+_CGI_HEADERS = ('CONTENT_TYPE', 'CONTENT_LENGTH')
+
+#: Kinds of reports that are not about a request, even when they carry the
+#: environ of the request that asked for them.
+NOT_REQUEST_KINDS = ('ThreadsDump', 'EventLoopBlocked', 'WorkersSaturated')
+
+#: Headers that are not written to captures unless explicitly asked.
+DEFAULT_REDACTED_HEADERS = ('HTTP_COOKIE', 'HTTP_AUTHORIZATION', 'HTTP_PROXY_AUTHORIZATION')
+
+
+def capture_record(traceback, max_body=64 * 1024, redacted_headers=DEFAULT_REDACTED_HEADERS):
+    """Build the capture record of the request of a report.
+
+    Returns ``None`` for reports that are not about a request, like stack
+    dumps and event loop stalls.  The ``redacted_headers`` are left out of
+    the record and only their names are kept.
+    """
+    if traceback.exception_type.rpartition('.')[2] in NOT_REQUEST_KINDS:
+        return None
+
+    environ = traceback.context.get('environ') or {}
+    if 'REQUEST_METHOD' not in environ or 'PATH_INFO' not in environ:
+        return None
+
+    headers, redacted = {}, []
+    for k, v in environ.items():
+        if not (k.startswith('HTTP_') or k in _CGI_HEADERS):
+            continue
+        if k in redacted_headers:
+            redacted.append(k)
+        else:
+            headers[k] = v
+
+    body = traceback.context.get('REQUEST_BODY') or {}
+    body_bytes = bytes_(body.get('Body') or b'')
+    timings = traceback.context.get('SLOW_REQUEST') or {}
+    return {
+        'v': CAPTURE_VERSION,
+        'time': time.time(),
+        'kind': traceback.exception_type,
+        'method': environ['REQUEST_METHOD'],
+        'script_name': environ.get('SCRIPT_NAME', ''),
+        'path': environ['PATH_INFO'],
+        'query_string': environ.get('QUERY_STRING', ''),
+        'headers': headers,
+        'redacted_headers': sorted(redacted),
+        'body': base64.b64encode(body_bytes[:max_body]).decode('ascii'),
+        'body_truncated': bool(body.get('Truncated')) or len(body_bytes) > max_body,
+        'duration': timings.get('Duration')
+    }
+
+
+def read_captures(path):
+    """Iterate over the records of a capture file, skipping corrupted lines."""
+    with io.open(path, encoding='utf-8') as captures:
+        for line in captures:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('v') in (1, CAPTURE_VERSION):
+                yield record
+
+
+def record_body(record):
+    """The captured body of a record as bytes."""
+    if record.get('v', CAPTURE_VERSION) == 1:
+        # Bodies were stored as text.
+        return bytes_(record.get('body', ''))
+    return base64.b64decode(record.get('body', ''))
+
+
+def build_environ(record, server_name='localhost', server_port='80'):
+    """WSGI environ that replays a captured request."""
+    body = record_body(record)
+    environ = {
+        'REQUEST_METHOD': record['method'],
+        'SCRIPT_NAME': record.get('script_name', ''),
+        'PATH_INFO': record['path'],
+        'QUERY_STRING': record.get('query_string', ''),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': server_port,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    environ.update(record.get('headers', {}))
+    if body or 'CONTENT_LENGTH' in environ:
+        # The captured body might be shorter than the original one,
+        # see the body_truncated flag of the record.
+        environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
@@ -0,0 +1,64 @@
+import gc
+import threading
+import time
+
+from backlash.frtools import get_thread_id
+
+
+def thread_cpu_clock():
+    """Clock measuring the CPU time of the calling OS thread.
+
+    The clock can be read with ``time.clock_gettime`` from any thread,
+    ``None`` is returned on platforms where that is not possible.
+    """
+    if not hasattr(time, 'pthread_getcpuclockid'):
+        return None
+    try:
+        return time.pthread_getcpuclockid(get_thread_id())
+    except (OSError, OverflowError):
+        return None
+
+
+class GCTimer(object):
+    """Total time spent in garbage collection, tracked through ``gc.callbacks``.
+
+    Collections stop every thread, so the time spent collecting while a
+    request was in progress is the pause the request suffered.
+    """
+
+    def __init__(self):
+        self.total = 0.0
+        self.collections = 0
+        self._started = None
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self._started = time.perf_counter()
+        elif self._started is not None:
+            self.total += time.perf_counter() - self._started
+            self.collections += 1
+            self._started = None
+
+    def install(self):
+        if self not in gc.callbacks:
+            gc.callbacks.append(self)
+
+    def uninstall(self):
+        if self in gc.callbacks:
+            gc.callbacks.remove(self)
+
+
+_gc_timer = None
+_gc_timer_lock = threading.Lock()
+
+
+def gc_pause_time():
+    """Seconds spent in garbage collection since the first call."""
+    global _gc_timer
+    if _gc_timer is None:
+        with _gc_timer_lock:
+            if _gc_timer is None:
+                timer = GCTimer()
+                timer.install()
+                _gc_timer = timer
+    return _gc_timer.total
@@ -0,0 +1,190 @@
+"""Aggregation of the reports of multiple worker processes.
+
+Under prefork servers every worker process has its own reporters, so
+the same error is reported once per worker and rate limits can't be
+enforced.  Workers can instead use a :class:`CollectorReporter`, which
+sends a compact event for each report over a Unix domain socket to a
+single :class:`Collector` per host, in charge of deduplicating, rate
+limiting and delivering the reports.
+
+The collector can run as a thread of the server master process::
+
+    collector = Collector('/run/myapp/backlash.sock', [EmailReporter(**errorware)])
+    collector.start()
+
+or as a standalone process through :meth:`Collector.serve_forever`.
+"""
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from backlash.tracing.events import serialize_traceback, fingerprint, EventTraceback
+
+log = logging.getLogger('backlash')
+
+#: Larger events are sent without frame locals and then without environ.
+MAX_EVENT_SIZE = 128 * 1024
+
+
+class CollectorUnavailable(Exception):
+    """The collector socket can't accept the event."""
+
+
+class CollectorReporter(object):
+    """Sends reports to a :class:`Collector` listening on ``socket_path``.
+
+    When the collector is not running or can't keep up with the events,
+    the report is delivered directly through ``fallback_reporters``.
+    """
+
+    def __init__(self, socket_path, fallback_reporters=None, **unused):
+        self.socket_path = socket_path
+        self.fallback_reporters = fallback_reporters or []
+        self._local = threading.local()
+
+    def _get_socket(self):
+        sock = getattr(self._local, 'socket', None)
+        if sock is None or getattr(self._local, 'pid', None) != os.getpid():
+            # Sockets are not shared across forks or threads.
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._local.socket = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _encode(self, traceback):
+        event = serialize_traceback(traceback)
+        data = json.dumps(event).encode('utf-8')
+        if len(data) > MAX_EVENT_SIZE:
+            for frame in event['frames']:
+                frame.pop('locals', None)
+            data = json.dumps(event).encode('utf-8')
+        if len(data) > MAX_EVENT_SIZE:
+            event['context']['environ'] = {}
+            data = json.dumps(event).encode('utf-8')
+        return data
+
+    def send(self, traceback):
+        """Send the report to the collector, raises :class:`CollectorUnavailable`"""
+        data = self._encode(traceback)
+        try:
+            self._get_socket().sendto(data, self.socket_path)
+        except socket.error as e:
+            raise CollectorUnavailable(e)
+
+    def report(self, traceback):
+        try:
+            self.send(traceback)
+            return
+        except CollectorUnavailable as e:
+            log.debug('Backlash collector unavailable (%s), reporting directly', e)
+
+        error = None
+        for r in self.fallback_reporters:
+            try:
+                r.report(traceback)
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+
+class Collector(threading.Thread):
+    """Receives events from :class:`CollectorReporter` and delivers them.
+
+    Events with the same fingerprint received within ``dedup_window``
+    seconds are delivered only once, the number of duplicates is reported
+    with the next delivery.  At most ``rate_limit`` reports are delivered
+    every ``rate_period`` seconds, the exceeding ones are discarded.
+    """
+
+    def __init__(self, socket_path, reporters, dedup_window=60,
+                 rate_limit=30, rate_period=60):
+        super(Collector, self).__init__(name='backlash-collector')
+        self.daemon = True
+        self.socket_path = socket_path
+        self.reporters = reporters
+        self.dedup_window = dedup_window
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+
+        self.received = 0
+        self.delivered = 0
+        self.duplicated = 0
+        self.rate_limited = 0
+
+        self._seen = {}
+        self._deliveries = []
+        self._socket = self._bind()
+
+    def _bind(self):
+        try:
+            os.unlink(self.socket_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.socket_path)
+        return sock
+
+    def run(self):
+        self.serve_forever()
+
+    def serve_forever(self):
+        while True:
+            try:
+                data = self._socket.recv(MAX_EVENT_SIZE * 2)
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                log.exception('Backlash collector socket failed')
+                return
+            try:
+                event = json.loads(data.decode('utf-8'))
+            except ValueError:
+                log.warning('Backlash collector received a malformed event')
+                continue
+            self.collect(event)
+
+    def collect(self, event):
+        """Deduplicate, rate limit and deliver an event."""
+        self.received += 1
+        now = time.time()
+
+        key = fingerprint(event)
+        last_delivery, duplicates, pids = self._seen.get(key, (0, 0, set()))
+        pids.add(event.get('pid'))
+        if now - last_delivery < self.dedup_window:
+            self.duplicated += 1
+            self._seen[key] = (last_delivery, duplicates + 1, pids)
+            return
+
+        self._deliveries = [t for t in self._deliveries if now - t < self.rate_period]
+        if len(self._deliveries) >= self.rate_limit:
+            self.rate_limited += 1
+            return
+        self._deliveries.append(now)
+
+        event['context']['COLLECTOR'] = {
+            'Fingerprint': key,
+            'DuplicatesSinceLastReport': duplicates,
+            'ProcessIDs': ', '.join(str(p) for p in sorted(pids, key=str))
+        }
+        self._seen[key] = (now, 0, set())
+        if len(self._seen) > 1024:
+            self._seen = dict((k, v) for k, v in self._seen.items()
+                              if now - v[0] < self.dedup_window)
+
+        self.deliver(EventTraceback(event))
+
+    def deliver(self, traceback):
+        self.delivered += 1
+        for r in self.reporters:
+            try:
+                r.report(traceback)
+            except Exception:
+                log.exception('Error while delivering collected report with %s', r)
@@ -0,0 +1,264 @@
+"""Delivery of the reports to the reporters.
+
+Reporters talk to external services which might be slow or down, so each
+one can be guarded by a :class:`CircuitBreaker`: its calls run in a thread
+of its own with a deadline and, when too many of them fail, the reporter
+is disabled for a while and reports fail fast instead of waiting for it.
+"""
+import logging
+import threading
+import time
+import traceback as _traceback
+from collections import deque
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+log = logging.getLogger('backlash')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    """The reporter is disabled as it failed too often."""
+
+
+class ReportTimeout(Exception):
+    """The reporter didn't complete the report within the deadline."""
+
+
+class _Call(object):
+    __slots__ = ('traceback', 'done', 'error', 'jobs', 'running', 'abandoned')
+
+    def __init__(self, traceback, jobs):
+        self.traceback = traceback
+        self.done = threading.Event()
+        self.error = None
+        # Queue of the worker the call was handed to.
+        self.jobs = jobs
+        self.running = False
+        self.abandoned = False
+
+
+class CircuitBreaker(object):
+    """Guards a reporter, looks like a reporter itself.
+
+    Each report must complete within ``timeout`` seconds.  When at least
+    ``min_calls`` of the last ``window`` reports were made and a
+    ``failure_rate`` of them failed or timed out, the circuit opens and
+    reports are refused with :class:`CircuitOpen` for ``reset_timeout``
+    seconds.  Then a single probe report is let through: the circuit
+    closes again if it succeeds and stays open otherwise.
+
+    Reports run one at a time in a worker thread.  Reports that timed out
+    are dropped if they didn't start yet and, when the worker is stuck on
+    one of them, it's abandoned and the following reports are handed to
+    a new worker, so a reporter that hangs forever doesn't hold up the
+    reports queued after it.
+    """
+
+    def __init__(self, reporter, timeout=10, failure_rate=0.5, min_calls=4, window=20,
+                 reset_timeout=30):
+        self.reporter = reporter
+        self.timeout = timeout
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.opened_at = None
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.trips = 0
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._probing = False
+        self._queue = None
+
+    def __repr__(self):
+        return '<CircuitBreaker %s %r>' % (self.state, self.reporter)
+
+    def _acquire(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(self.reporter)
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    raise CircuitOpen(self.reporter)
+                self._probing = True
+            self.calls += 1
+
+    def _record(self, success):
+        with self._lock:
+            if not success:
+                self.failures += 1
+
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    self.state = CLOSED
+                else:
+                    self._trip()
+                return
+
+            self._outcomes.append(success)
+            failed = self._outcomes.count(False)
+            if (not success and len(self._outcomes) >= self.min_calls
+                    and failed >= self.failure_rate * len(self._outcomes)):
+                self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        self._outcomes.clear()
+
+    def _work(self, jobs):
+        while True:
+            call = jobs.get()
+            with self._lock:
+                if call.abandoned:
+                    continue
+                call.running = True
+
+            try:
+                self.reporter.report(call.traceback)
+            except Exception as e:
+                call.error = e
+                log.debug('Reporter %s failed', self.reporter, exc_info=True)
+            call.done.set()
+
+            with self._lock:
+                if jobs is not self._queue:
+                    # Worker was abandoned while stuck on this call.
+                    return
+
+    def _start_worker(self):
+        # Must be called with the lock held.
+        self._queue = queue.Queue()
+        worker = threading.Thread(target=self._work, args=(self._queue, ),
+                                  name='backlash-reporter-%s' % self.reporter)
+        worker.daemon = True
+        worker.start()
+
+    def _abandon(self, call):
+        """Drop a call that timed out, replacing the worker if stuck on it."""
+        with self._lock:
+            call.abandoned = True
+            if not call.running or call.done.is_set() or call.jobs is not self._queue:
+                return
+
+            stuck = self._queue
+            self._start_worker()
+            while True:
+                try:
+                    pending = stuck.get_nowait()
+                except queue.Empty:
+                    break
+                pending.jobs = self._queue
+                self._queue.put(pending)
+
+    def start(self, traceback):
+        """Start reporting ``traceback``, the report runs in the breaker thread."""
+        self._acquire()
+        with self._lock:
+            if self._queue is None:
+                self._start_worker()
+            call = _Call(traceback, self._queue)
+            self._queue.put(call)
+        return call
+
+    def finish(self, call):
+        """Wait for a report started by :meth:`start`, raising its error."""
+        if not call.done.wait(self.timeout):
+            self._abandon(call)
+            self.timeouts += 1
+            self._record(False)
+            raise ReportTimeout('no response in %ss' % self.timeout)
+
+        self._record(call.error is None)
+        if call.error is not None:
+            raise call.error
+
+    def report(self, traceback):
+        self.finish(self.start(traceback))
+
+    def stats(self):
+        return {'State': self.state,
+                'Calls': self.calls,
+                'Failures': self.failures,
+                'Timeouts': self.timeouts,
+                'Rejected': self.rejected,
+                'Trips': self.trips}
+
+
+def guard_reporters(reporters, timeout=None, **options):
+    """Wrap each reporter in a :class:`CircuitBreaker`, ``None`` timeout disables it."""
+    if timeout is None:
+        return list(reporters)
+    return [r if isinstance(r, CircuitBreaker) else CircuitBreaker(r, timeout, **options)
+            for r in reporters]
+
+
+def _spool(spool, reporter, traceback, errors):
+    try:
+        spool.store(reporter, traceback)
+    except Exception as e:
+        errors.write('Unable to spool the report for %s: %s\n' % (reporter, e))
+        return False
+    return True
+
+
+def _failed(errors, what, reporter, error, traceback, spool):
+    reason = _traceback.format_exception_only(type(error), error)[-1].strip()
+    message = '\nError while reporting %s with %s: %s\n' % (what, reporter, reason)
+    if isinstance(reporter, CircuitBreaker) and reporter.state == OPEN:
+        message += 'Reporter disabled for %ss\n' % reporter.reset_timeout
+    errors.write(message)
+    if spool is not None and _spool(spool, reporter, traceback, errors):
+        errors.write('Report spooled for later delivery\n')
+
+
+def deliver(reporters, traceback, errors, what, spool=None):
+    """Send ``traceback`` to all the ``reporters``.
+
+    Guarded reporters run concurrently, so a slow one doesn't delay the
+    others, and are skipped while their circuit is open.  Failures are
+    written as a single line to the ``errors`` stream and logged with
+    their traceback at debug level.  When a :class:`backlash.tracing.spool.Spool`
+    is provided, reports that failed or were skipped are stored there to be
+    delivered again later.
+    """
+    calls = []
+    for r in reporters:
+        if isinstance(r, CircuitBreaker):
+            try:
+                calls.append((r, r.start(traceback)))
+            except CircuitOpen:
+                if spool is not None:
+                    _spool(spool, r, traceback, errors)
+            continue
+
+        try:
+            r.report(traceback)
+        except Exception as e:
+            log.debug('Reporter %s failed', r, exc_info=True)
+            _failed(errors, what, r, e, traceback, spool)
+
+    for r, call in calls:
+        try:
+            r.finish(call)
+        except Exception as e:
+            _failed(errors, what, r, e, traceback, spool)
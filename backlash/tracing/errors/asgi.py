@@ -0,0 +1,76 @@
+import asyncio
+import sys
+
+from backlash.tbtools import get_current_traceback
+from backlash.utils import RequestContext, environ_from_scope
+from .middleware import TraceErrorsMiddleware
+
+import logging
+log = logging.getLogger('backlash')
+
+
+class ASGITraceErrorsMiddleware(TraceErrorsMiddleware):
+    """ASGI version of :class:`TraceErrorsMiddleware`.
+
+    Reporters are run in ``executor`` (the event loop default executor when
+    ``None``) so that their I/O never blocks the event loop.  The context
+    injectors receive the ASGI scope instead of the WSGI environ.
+    """
+
+    def __init__(self, application, reporters, context_injectors, executor=None,
+                 environ_policy=None, reporter_timeout=None, spool_dir=None):
+        super(ASGITraceErrorsMiddleware, self).__init__(application, reporters,
+                                                        context_injectors, environ_policy,
+                                                        reporter_timeout=reporter_timeout,
+                                                        spool_dir=spool_dir)
+        self.executor = executor
+
+    def _capture_traceback(self, scope):
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ_from_scope(scope))})
+        for injector in self.context_injectors:
+            context.update(injector(scope))
+
+        return get_current_traceback(skip=1, show_hidden_frames=False, context=context)
+
+    @staticmethod
+    def _check_reported(future):
+        error = future.exception()
+        if error is not None:
+            log.error('Failed to report the exception', exc_info=(type(error), error,
+                                                                  error.__traceback__))
+
+    def _report_errors(self, traceback):
+        log.debug(traceback.plaintext)
+        traceback.log(sys.stderr)
+        self._deliver(traceback, sys.stderr)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        response_started = False
+
+        async def _send(message):
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        except Exception:
+            traceback = self._capture_traceback(scope)
+            loop = asyncio.get_running_loop()
+            reported = loop.run_in_executor(self.executor, self._report_errors, traceback)
+            reported.add_done_callback(self._check_reported)
+
+            if response_started:
+                # Nothing fancy can be done once the response started,
+                # let the server abort it instead of faking a complete one.
+                log.error('Tracing middleware caught exception in streamed '
+                          'response at a point where response headers were already sent.')
+                raise
+
+            await send({'type': 'http.response.start', 'status': 500,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': b'Internal Server Error'})
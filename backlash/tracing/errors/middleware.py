@@ -1,19 +1,32 @@
 from backlash._compat import string_types, bytes_
 from backlash.tbtools import get_current_traceback
-from backlash.utils import RequestContext
+from backlash.tracing.delivery import deliver, guard_reporters
+from backlash.tracing.spool import Spool
+from backlash.tracing.input import install_input_tee, body_context
+from backlash.tracing.response import is_sequence, get_file_wrapper
+from backlash.utils import RequestContext, default_environ_policy
 
 import logging
 log = logging.getLogger('backlash')
 
 
 class TraceErrorsMiddleware(object):
-    def __init__(self, application, reporters, context_injectors):
+    def __init__(self, application, reporters, context_injectors, environ_policy=None,
+                 capture_body=0, reporter_timeout=None, spool_dir=None):
         self.app = application
-        self.reporters = reporters
+        # When reporter_timeout is provided each reporter has that many seconds
+        # to complete and is disabled for a while when it keeps failing.
+        self.reporters = guard_reporters(reporters, reporter_timeout)
+        # Reports that fail are kept in spool_dir and delivered again later.
+        self.spool = Spool(spool_dir, self.reporters) if spool_dir else None
         self.context_injectors = context_injectors
+        self.environ_policy = environ_policy or default_environ_policy
+        # Bytes of the request body kept to be reported.
+        self.capture_body = capture_body
 
     def _report_errors(self, environ, recorded_exc_info=None):
-        context = RequestContext({'environ': dict(environ)})
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ)})
+        context.update(body_context(environ))
         for injector in self.context_injectors:
             context.update(injector(environ))
 
@@ -26,13 +39,10 @@ class TraceErrorsMiddleware(object):
         log.debug(traceback.plaintext)
         traceback.log(environ['wsgi.errors'])
 
-        for r in self.reporters:
-            try:
-                r.report(traceback)
-            except Exception:
-                error = get_current_traceback(skip=1, show_hidden_frames=False)
-                environ['wsgi.errors'].write('\nError while reporting exception with %s\n' % r)
-                environ['wsgi.errors'].write(error.plaintext)
+        self._deliver(traceback, environ['wsgi.errors'])
+
+    def _deliver(self, traceback, errors):
+        deliver(self.reporters, traceback, errors, 'exception', self.spool)
 
     def _generate_response(self, environ, start_response):
         try:
@@ -71,6 +81,9 @@ class TraceErrorsMiddleware(object):
                 yield chunk
 
     def __call__(self, environ, start_response):
+        if self.capture_body:
+            install_input_tee(environ, self.capture_body)
+
         app_iter = None
         try:
             app_iter = self.app(environ, start_response)
@@ -82,4 +95,9 @@ class TraceErrorsMiddleware(object):
                 environ = environ.pop('backlash.exc_environ', environ)
                 self._report_errors(environ, recorded_exc_info)
 
+        if is_sequence(app_iter) or get_file_wrapper(environ, app_iter) is not None:
+            # Nothing can fail while iterating them, so they are passed through
+            # which also preserves the server ability to sendfile.
+            return app_iter
+
         return self._report_errors_while_consuming_iter(app_iter, environ, start_response)
@@ -0,0 +1,185 @@
+"""Plain data representation of backlash tracebacks.
+
+Tracebacks hold references to live frames and to the WSGI environ, so they
+can't leave the process that generated them.  Events are a compact version
+made only of strings and numbers that can be serialized as JSON and turned
+back into objects that reporters can use like tracebacks.
+"""
+import base64
+import hashlib
+import os
+import time
+
+from backlash._compat import text_, string_types, binary_type
+from backlash.utils import RequestContext
+
+#: Length after which the repr of values is truncated.
+MAX_REPR_LENGTH = 500
+
+
+def _safe_repr(value, max_length=MAX_REPR_LENGTH):
+    try:
+        value = repr(value)
+    except Exception as e:
+        value = '<unrepresentable %s: %r>' % (type(value).__name__, e)
+    if len(value) > max_length:
+        value = value[:max_length] + '...'
+    return value
+
+
+def _serialize_value(value):
+    if isinstance(value, string_types):
+        return value
+    if isinstance(value, binary_type):
+        # Like request bodies, which can be binary.
+        return {'base64': base64.b64encode(value).decode('ascii')}
+    return _safe_repr(value)
+
+
+def _deserialize_value(value):
+    if isinstance(value, dict) and list(value) == ['base64']:
+        return base64.b64decode(value['base64'])
+    return value
+
+
+def serialize_frame(frame, with_locals=False, context_lines=3):
+    pre_context, context_line, post_context = frame.source_context(context_lines)
+    record = {
+        'filename': frame.filename,
+        'lineno': frame.lineno,
+        'function': frame.function_name,
+        'module': frame.module,
+        'pre_context': pre_context,
+        'context_line': context_line,
+        'post_context': post_context
+    }
+    if with_locals:
+        record['locals'] = dict((text_(str(k)), _safe_repr(v)) for k, v in frame.locals.items())
+    return record
+
+
+def serialize_environ(environ):
+    """Keep only the entries of the environ that are plain strings."""
+    return dict((k, v) for k, v in environ.items() if isinstance(v, string_types))
+
+
+def serialize_traceback(traceback, locals_frames=2):
+    """Convert a traceback to a dictionary of plain values.
+
+    The locals of the last ``locals_frames`` frames are kept as their repr.
+    Tracebacks rebuilt from events keep the time and the pid of the event.
+    """
+    recorded = getattr(traceback, 'event', None) or {}
+    frames = traceback.frames
+    first_with_locals = len(frames) - locals_frames
+    context = {}
+    for key, value in (traceback.context or {}).items():
+        if key == 'environ':
+            context[key] = serialize_environ(value)
+        elif key == 'request':
+            # WebOb requests are not serializable and can be rebuilt from environ.
+            continue
+        elif isinstance(value, dict):
+            context[key] = dict((text_(str(k)), _serialize_value(v)) for k, v in value.items())
+        else:
+            context[key] = _safe_repr(value)
+
+    return {
+        'v': 1,
+        'time': recorded.get('time') or time.time(),
+        'pid': recorded.get('pid') or os.getpid(),
+        'exception_type': traceback.exception_type,
+        'exception': traceback.exception,
+        'backlash_event': bool(getattr(traceback.exc_value, 'backlash_event', False)),
+        'plaintext': traceback.plaintext,
+        'frames': [serialize_frame(f, with_locals=idx >= first_with_locals)
+                   for idx, f in enumerate(frames)],
+        'context': context
+    }
+
+
+def fingerprint(event, frames=None):
+    """Identifier of events produced by the same error at the same place.
+
+    Only the innermost ``frames`` are considered when provided.
+    """
+    stack = event['frames']
+    if frames is not None:
+        stack = stack[-frames:]
+    parts = [event['exception_type']]
+    parts.extend('%s:%s:%s' % (f['filename'], f['function'], f['lineno']) for f in stack)
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _exception_message(event):
+    """The message of the exception, without the type name that prefixes it."""
+    exception, exception_type = event['exception'], event['exception_type']
+    for prefix in (exception_type + ': ', exception_type.rpartition('.')[2] + ': '):
+        if exception.startswith(prefix):
+            return exception[len(prefix):]
+    if exception in (exception_type, exception_type.rpartition('.')[2]):
+        return ''
+    return exception
+
+
+class RecordedValue(object):
+    """A value that was recorded by its repr."""
+    __slots__ = ('_repr', )
+
+    def __init__(self, value_repr):
+        self._repr = value_repr
+
+    def __repr__(self):
+        return self._repr
+
+
+class EventException(Exception):
+    """Exception rebuilt from an event."""
+
+    def __init__(self, message, backlash_event=False):
+        super(EventException, self).__init__(message)
+        self.backlash_event = backlash_event
+
+
+class EventFrame(object):
+    """A frame rebuilt from an event, looks like :class:`backlash.tbtools.Frame`"""
+
+    def __init__(self, record):
+        self.filename = record['filename']
+        self.lineno = record['lineno']
+        self.function_name = record['function']
+        self.module = record.get('module')
+        self.current_line = record.get('context_line') or ''
+        self.locals = dict((k, RecordedValue(v)) for k, v in record.get('locals', {}).items())
+        self._pre_context = record.get('pre_context', [])
+        self._post_context = record.get('post_context', [])
+
+    def source_context(self, lines=5):
+        pre_context = self._pre_context[-lines:] if lines else []
+        return pre_context, self.current_line, self._post_context[:lines]
+
+
+class EventTraceback(object):
+    """A traceback rebuilt from an event, looks like :class:`backlash.tbtools.Traceback`"""
+
+    def __init__(self, event):
+        self.event = event
+        self.exception_type = event['exception_type']
+        self.exception = event['exception']
+        self.plaintext = event['plaintext']
+        self.exc_value = EventException(_exception_message(event),
+                                        event.get('backlash_event', False))
+        self.exc_type = type(self.exc_value)
+        self.exc_info = (self.exc_type, self.exc_value, None)
+        self.frames = [EventFrame(f) for f in event['frames']]
+        self.context = RequestContext(event['context'])
+        for key, value in self.context.items():
+            if isinstance(value, dict) and key != 'environ':
+                self.context[key] = dict((k, _deserialize_value(v)) for k, v in value.items())
+        self.context.setdefault('environ', {})
+
+    def generate_plaintext_traceback(self):
+        return iter(self.plaintext.split('\n'))
+
+    def log(self, logfile):
+        logfile.write(self.plaintext.rstrip() + '\n')
@@ -0,0 +1,251 @@
+import datetime as dt
+import json
+import threading
+import time
+
+from backlash._compat import text_
+from backlash.frtools import get_thread_id
+from backlash.utils import escape
+from .clocks import thread_cpu_clock, gc_pause_time
+
+
+class InflightRequest(object):
+    """A request currently being served by the process.
+
+    Only the thread serving the request updates it, so it can be
+    read by other threads without locking.
+
+    The CPU time of the serving thread is tracked unless the thread is shared
+    with other requests, it can be read while the request is in progress only
+    where the CPU clock of a thread is readable from other threads.
+    """
+    __slots__ = ('thread_id', 'path', 'method', 'started', 'bytes_sent', 'environ',
+                 'headers_at', 'first_byte_at', 'last_chunk_at', 'task',
+                 'cpu_clock', 'cpu_started', 'gc_started', 'ended', 'cpu_ended', 'gc_ended',
+                 'checks')
+
+    def __init__(self, thread_id, path, method, started, environ=None):
+        self.thread_id = thread_id
+        self.path = path
+        self.method = method
+        self.started = started
+        self.bytes_sent = 0
+        self.environ = environ
+        self.headers_at = None
+        self.first_byte_at = None
+        self.last_chunk_at = None
+        # The asyncio task or greenlet serving the request,
+        # when the thread is shared by multiple requests.
+        self.task = None
+        # Pending timer jobs of the middlewares checking the request.
+        self.checks = []
+
+        self.cpu_clock = None
+        self.cpu_started = None
+        self.gc_started = gc_pause_time()
+        self.ended = self.cpu_ended = self.gc_ended = None
+
+    id = property(lambda x: id(x))
+
+    def start_cpu_accounting(self):
+        """Start tracking the CPU time of the calling thread."""
+        self.cpu_clock = thread_cpu_clock()
+        if self.cpu_clock is not None:
+            self.cpu_started = time.clock_gettime(self.cpu_clock)
+        else:
+            self.cpu_started = time.thread_time()
+
+    def finish(self):
+        """Freeze the timings of the request once it's completed."""
+        self.ended = time.time()
+        self.gc_ended = gc_pause_time()
+        if self.cpu_started is None:
+            return
+        if self.cpu_clock is not None:
+            self.cpu_ended = self._read_cpu_clock()
+        elif get_thread_id() == self.thread_id:
+            self.cpu_ended = time.thread_time()
+
+    @property
+    def duration(self):
+        return (self.ended or time.time()) - self.started
+
+    @property
+    def cpu_time(self):
+        """CPU seconds used by the request, ``None`` when not available."""
+        if self.cpu_ended is not None:
+            return self.cpu_ended - self.cpu_started
+        if self.cpu_clock is not None and self.ended is None:
+            now = self._read_cpu_clock()
+            if now is not None:
+                return now - self.cpu_started
+        return None
+
+    def _read_cpu_clock(self):
+        try:
+            return time.clock_gettime(self.cpu_clock)
+        except OSError:
+            # The thread of the request already exited.
+            return None
+
+    @property
+    def gc_time(self):
+        """Seconds spent in garbage collection while the request was in progress.
+
+        Collections are counted for the whole process, whichever thread
+        triggered them, as they pause every thread.
+        """
+        return (self.gc_ended if self.gc_ended is not None else gc_pause_time()) - self.gc_started
+
+    @property
+    def time_to_first_byte(self):
+        if self.first_byte_at is None:
+            return None
+        return self.first_byte_at - self.started
+
+    @property
+    def throughput(self):
+        """Bytes per second sent since the first byte."""
+        if self.first_byte_at is None:
+            return 0.0
+        elapsed = time.time() - self.first_byte_at
+        if elapsed <= 0:
+            return float(self.bytes_sent)
+        return self.bytes_sent / elapsed
+
+    def timings(self):
+        """Timings of the request, as reported for slow requests."""
+        def _seconds(at):
+            return None if at is None else round(at - self.started, 3)
+        duration = self.duration
+        cpu_time = self.cpu_time
+        return {'TimeToHeaders': _seconds(self.headers_at),
+                'TimeToFirstByte': _seconds(self.first_byte_at),
+                'Duration': round(duration, 3),
+                'CPUTime': None if cpu_time is None else round(cpu_time, 3),
+                'CPURatio': None if cpu_time is None or duration <= 0 else '%.1f%%' % (
+                    100.0 * cpu_time / duration),
+                'ProcessGCTime': round(self.gc_time, 3),
+                'BytesSent': self.bytes_sent,
+                'Throughput': '%.1f B/s' % self.throughput}
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'thread_id': self.thread_id,
+            'method': self.method,
+            'path': self.path,
+            'started': str(dt.datetime.utcfromtimestamp(self.started)),
+            'duration': round(self.duration, 3),
+            'time_to_first_byte': self.time_to_first_byte,
+            'cpu_time': self.cpu_time,
+            'process_gc_time': self.gc_time,
+            'bytes_sent': self.bytes_sent
+        }
+
+    def describe(self):
+        return '%s %s, started %s, running for %.3fs' % (
+            self.method, self.path,
+            dt.datetime.utcfromtimestamp(self.started), self.duration
+        )
+
+
+class InflightRequests(object):
+    """Registry of the requests that are currently in progress.
+
+    Each request is stored under its own key, so requests can be added
+    and removed concurrently without any lock.
+    """
+
+    def __init__(self):
+        self._requests = {}
+
+    def begin(self, environ, thread_id=None, task=None):
+        """Register the request for ``environ`` as in progress.
+
+        The request is considered served by the current thread,
+        unless a different ``thread_id`` is provided.  CPU time is tracked
+        only when the thread is not shared through a ``task``.
+        """
+        if thread_id is None:
+            thread_id = threading.current_thread().ident
+        request = InflightRequest(thread_id,
+                                  environ.get('PATH_INFO', ''),
+                                  environ.get('REQUEST_METHOD', ''),
+                                  time.time(), environ)
+        request.task = task
+        if task is None:
+            request.start_cpu_accounting()
+        self._requests[id(request)] = request
+        return request
+
+    def end(self, request):
+        """Remove a request previously registered by :meth:`begin`"""
+        if self._requests.pop(id(request), None) is not None:
+            request.finish()
+
+    def get(self, request_id):
+        """The request in progress with the given id or ``None``"""
+        return self._requests.get(request_id)
+
+    def snapshot(self):
+        """List of the requests in progress, the oldest ones first."""
+        requests = list(self._requests.values())
+        requests.sort(key=lambda r: r.started)
+        return requests
+
+    def by_thread(self):
+        """Requests in progress grouped by the thread serving them."""
+        threads = {}
+        for request in self.snapshot():
+            threads.setdefault(request.thread_id, []).append(request)
+        return threads
+
+    def __len__(self):
+        return len(self._requests)
+
+
+INFLIGHT_HTML = text_('''\
+<!DOCTYPE html>
+<html>
+  <head><title>Requests in progress // Backlash</title></head>
+  <body>
+    <h1>%(count)d requests in progress</h1>
+    <table>
+      <tr><th>Thread</th><th>Method</th><th>Path</th><th>Started</th>
+          <th>Duration</th><th>Bytes Sent</th><th></th></tr>
+%(rows)s
+    </table>
+  </body>
+</html>
+''')
+
+INFLIGHT_ROW_HTML = text_('''\
+      <tr><td>%(thread_id)s</td><td>%(method)s</td><td>%(path)s</td><td>%(started)s</td>
+          <td>%(duration).3fs</td><td>%(bytes_sent)d</td>
+          <td><a href="%(stack_url)s">grab stack now</a></td></tr>''')
+
+
+def render_inflight_json(requests):
+    """Render the requests in progress as JSON."""
+    return json.dumps({'requests': [r.as_dict() for r in requests]})
+
+
+def render_inflight_html(requests, stack_url):
+    """Render the requests in progress as an HTML page.
+
+    ``stack_url`` is called with the id of each request and returns the
+    URL of the action that grabs its stack.
+    """
+    rows = []
+    for request in requests:
+        values = request.as_dict()
+        values.update({'method': escape(values['method']),
+                       'path': escape(values['path']),
+                       'stack_url': escape(stack_url(request.id), True)})
+        rows.append(INFLIGHT_ROW_HTML % values)
+    return INFLIGHT_HTML % {'count': len(requests), 'rows': text_('\n'.join(rows))}
+
+
+#: Process wide registry used by the middlewares when none is provided.
+inflight_requests = InflightRequests()
@@ -0,0 +1,87 @@
+from backlash._compat import text_, binary_type
+
+#: Key of the environ where the :class:`TeeInput` of the request is stored.
+ENVIRON_KEY = 'backlash.input_tee'
+
+
+class TeeInput(object):
+    """Wraps ``wsgi.input`` keeping a copy of the first ``limit`` bytes read.
+
+    The application keeps reading the stream as usual, only the beginning
+    of the body is copied so that it can be reported after it was consumed.
+    """
+
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._captured = bytearray()
+        self.limit = limit
+        self.truncated = False
+
+    def _record(self, data):
+        if self.truncated or not data:
+            return data
+        room = self.limit - len(self._captured)
+        if len(data) > room:
+            self.truncated = True
+            self._captured += data[:room]
+        else:
+            self._captured += data
+        return data
+
+    @property
+    def captured(self):
+        """The beginning of the body read so far by the application."""
+        return bytes(self._captured)
+
+    def read(self, *args):
+        return self._record(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._record(self._stream.readline(*args))
+
+    def readlines(self, *args):
+        lines = self._stream.readlines(*args)
+        for line in lines:
+            self._record(line)
+        return lines
+
+    def __iter__(self):
+        for line in self._stream:
+            yield self._record(line)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def install_input_tee(environ, limit):
+    """Replace ``wsgi.input`` with a :class:`TeeInput` capturing ``limit`` bytes."""
+    tee = environ.get(ENVIRON_KEY)
+    if tee is None and 'wsgi.input' in environ:
+        tee = environ['wsgi.input'] = environ[ENVIRON_KEY] = TeeInput(environ['wsgi.input'],
+                                                                        limit)
+    return tee
+
+
+def body_text(body):
+    """Text view of a captured body, bytes that are not UTF-8 are replaced."""
+    if isinstance(body, binary_type):
+        return text_(body, 'utf-8', 'replace')
+    return body
+
+
+def body_context(environ):
+    """Context entry with the captured beginning of the request body, if any.
+
+    The body is kept as the bytes read by the application,
+    :func:`body_text` provides a text view of it.
+    """
+    tee = environ.get(ENVIRON_KEY)
+    if tee is None:
+        return {}
+
+    captured = tee.captured
+    return {'REQUEST_BODY': {'ContentLength': environ.get('CONTENT_LENGTH', ''),
+                             'ContentType': environ.get('CONTENT_TYPE', ''),
+                             'Captured': len(captured),
+                             'Truncated': tee.truncated,
+                             'Body': captured}}
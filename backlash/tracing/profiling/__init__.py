@@ -0,0 +1,2 @@
+from .middleware import ProfilingMiddleware
+from .memory import MemoryGrowthMiddleware
\ No newline at end of file
@@ -0,0 +1,199 @@
+import itertools
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from backlash.tracing.delivery import deliver, guard_reporters
+from backlash.tracing.events import EventTraceback
+from backlash.tracing.response import close_response
+from backlash.utils import default_environ_policy
+
+
+def current_rss():
+    """Resident memory of the process in bytes, or ``None`` when unknown.
+
+    Where ``/proc`` is not available the peak resident memory is returned.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GiB' % size
+
+
+class _Tracing(object):
+    """Keeps tracemalloc running while the sampled request is in progress.
+
+    Only one request is traced at a time, :meth:`acquire` returns ``False``
+    while another one is.  Tracing started by someone else is left untouched.
+    """
+
+    def __init__(self, frame_depth):
+        self.frame_depth = frame_depth
+        self._lock = threading.Lock()
+        self._owned = False
+
+    def acquire(self):
+        if not self._lock.acquire(False):
+            return False
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frame_depth)
+            self._owned = True
+        return True
+
+    def release(self):
+        if self._owned:
+            tracemalloc.stop()
+            self._owned = False
+        self._lock.release()
+
+
+_SNAPSHOT_FILTERS = (tracemalloc.Filter(False, tracemalloc.__file__),
+                     tracemalloc.Filter(False, linecache.__file__))
+
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+class MemoryGrowthMiddleware(object):
+    """Reports requests that grow the memory of the process.
+
+    One request every ``sample_rate`` is traced with ``tracemalloc``, keeping
+    ``frame_depth`` frames for each allocation, and its resident and traced
+    memory are measured before and after it.  When either grows by more than
+    ``threshold`` bytes, the ``top`` allocation sites that grew the most are
+    reported through the ``reporters``.
+
+    Tracemalloc traces the whole process: while a sampled request is in
+    progress every allocation of every thread is recorded, which makes
+    allocation heavy code up to twenty times slower in every concurrent
+    request, and the snapshots taken before and after the request pause
+    them while the traces are copied.  Their allocations are included in
+    the report too.  To bound this cost only one request is traced at a
+    time, a sampled request arriving while another one is traced is served
+    untraced, and the default ``sample_rate`` is low.  Requests that are
+    not sampled only pay for a counter increment and nothing is done at
+    all when ``sample_rate`` is ``0``.
+
+    The environ entries kept by the reports are chosen by ``environ_policy``,
+    a :class:`backlash.utils.EnvironSnapshotPolicy`.
+    """
+
+    def __init__(self, app, reporters, context_injectors, threshold=50 * 1024 * 1024,
+                 sample_rate=100, frame_depth=10, top=10, reporter_timeout=None,
+                 environ_policy=None):
+        self.app = app
+        self.reporters = guard_reporters(reporters, reporter_timeout)
+        self.context_injectors = context_injectors
+        self.environ_policy = environ_policy or default_environ_policy
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.top = top
+        self._tracing = _Tracing(frame_depth)
+        self._counter = itertools.count(1)
+
+    def __call__(self, environ, start_response):
+        if not self.sample_rate or next(self._counter) % self.sample_rate:
+            return self.app(environ, start_response)
+
+        if not self._tracing.acquire():
+            return self.app(environ, start_response)
+
+        rss_before = current_rss()
+        try:
+            snapshot = _take_snapshot()
+            traced_before = tracemalloc.get_traced_memory()[0]
+            app_iter = self.app(environ, start_response)
+        except Exception:
+            self._tracing.release()
+            raise
+
+        def _on_close():
+            try:
+                self._measure(environ, rss_before, traced_before, snapshot)
+            finally:
+                self._tracing.release()
+
+        return close_response(environ, app_iter, _on_close)
+
+    def _measure(self, environ, rss_before, traced_before, snapshot):
+        traced_growth = tracemalloc.get_traced_memory()[0] - traced_before
+        rss_after = current_rss()
+        rss_growth = 0
+        if rss_before is not None and rss_after is not None:
+            rss_growth = rss_after - rss_before
+        if max(traced_growth, rss_growth) < self.threshold:
+            return
+
+        allocations = [s for s in _take_snapshot().compare_to(snapshot, 'traceback')
+                       if s.size_diff > 0][:self.top]
+        traceback = self.build_report(environ, allocations, max(traced_growth, rss_growth), {
+            'RSSBefore': rss_before and format_size(rss_before),
+            'RSSAfter': rss_after and format_size(rss_after),
+            'RSSGrowth': format_size(rss_growth),
+            'TracedGrowth': format_size(traced_growth)
+        })
+
+        deliver(self.reporters, traceback, environ['wsgi.errors'], 'memory growth')
+
+    def build_report(self, environ, allocations, growth, measures):
+        """Report of the allocations as a traceback of the largest one."""
+        context = {'environ': self.environ_policy.snapshot(environ)}
+        for injector in self.context_injectors:
+            context.update(injector(environ))
+
+        message = '%s %s grew memory by %s' % (environ.get('REQUEST_METHOD', ''),
+                                               environ.get('PATH_INFO', ''),
+                                               format_size(growth))
+        sites = []
+        for idx, stat in enumerate(allocations):
+            frame = stat.traceback[-1]
+            sites.append('#%d %s:%d +%s in %+d blocks' % (idx + 1, frame.filename, frame.lineno,
+                                                         format_size(stat.size_diff),
+                                                         stat.count_diff))
+        context['MEMORY_GROWTH'] = dict(measures, Time=time.strftime('%Y-%m-%d %H:%M:%S'),
+                                        TopAllocations='\n'.join(sites))
+
+        frames = []
+        if allocations:
+            for frame in allocations[0].traceback:
+                frames.append({'filename': frame.filename, 'lineno': frame.lineno,
+                               'function': '?',
+                               'context_line': linecache.getline(frame.filename,
+                                                                 frame.lineno).strip()})
+
+        plaintext = ['Traceback of the largest allocation (most recent call last):']
+        for frame in frames:
+            plaintext.append('  File "%(filename)s", line %(lineno)s' % frame)
+            plaintext.append('    %(context_line)s' % frame)
+        plaintext.append('MemoryGrowth: %s' % message)
+        plaintext.append('')
+        plaintext.append('Top allocations:')
+        for site in sites:
+            plaintext.append('  ' + site)
+
+        return EventTraceback({'exception_type': 'MemoryGrowth',
+                               'exception': 'MemoryGrowth: %s' % message,
+                               'backlash_event': True,
+                               'plaintext': '\n'.join(plaintext),
+                               'frames': frames,
+                               'context': context})
@@ -0,0 +1,137 @@
+import cProfile
+import itertools
+import time
+
+from backlash._compat import bytes_
+from backlash.utils import check_secret
+from backlash.tracing.response import close_response
+
+try:
+    from urllib.parse import parse_qs, urlencode
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qs
+    from urllib import urlencode
+
+from .stats import (ProfilesRegistry, render_routes_html, render_routes_json,
+                    render_route_html, render_route_json)
+
+
+def default_route(environ):
+    return '%s %s' % (environ.get('REQUEST_METHOD', ''), environ.get('PATH_INFO', ''))
+
+
+class ProfilingMiddleware(object):
+    """Profiles a sample of the requests with cProfile.
+
+    One request every ``sample_rate`` is profiled, along with any request
+    that provides the ``admin_secret`` through the ``trigger_param`` query
+    parameter.  Results are merged by route, as returned by ``route_key``
+    (by default method and path), keeping the last ``max_routes`` routes.
+
+    Results are served at ``profiles_path``, protected by ``admin_secret``:
+    the list of routes, the functions of a route sorted by ``sort`` as HTML
+    or as JSON when ``format=json`` is provided, or the stats of the route
+    as a ``.prof`` file readable by ``pstats`` when ``format=prof`` is provided.
+
+    Requests that are not sampled only pay for a counter increment.
+    """
+
+    def __init__(self, app, admin_secret, sample_rate=100, trigger_param='__profile',
+                 profiles_path='/__profiles__', max_routes=50, route_key=None):
+        if not admin_secret:
+            raise ValueError("Backlash profiling requires the admin_secret setting")
+
+        self.app = app
+        self.admin_secret = admin_secret
+        self.sample_rate = sample_rate
+        self.trigger_param = trigger_param
+        self.profiles_path = profiles_path
+        self.route_key = route_key or default_route
+        self.profiles = ProfilesRegistry(max_routes)
+        self._counter = itertools.count(1)
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') == self.profiles_path:
+            return self._serve_profiles(environ, start_response)
+
+        if not self._is_sampled(environ):
+            return self.app(environ, start_response)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this interpreter.
+            return self.app(environ, start_response)
+
+        started = time.time()
+
+        def _on_close():
+            profiler.disable()
+            self.profiles.add(self.route_key(environ), profiler, time.time() - started)
+
+        try:
+            app_iter = self.app(environ, start_response)
+        except Exception:
+            profiler.disable()
+            raise
+        return close_response(environ, app_iter, _on_close)
+
+    def _is_sampled(self, environ):
+        if self.sample_rate and next(self._counter) % self.sample_rate == 0:
+            return True
+
+        query = environ.get('QUERY_STRING')
+        if query and self.trigger_param in query:
+            return check_secret(parse_qs(query).get(self.trigger_param, [None])[0],
+                                self.admin_secret)
+        return False
+
+    def _serve_profiles(self, environ, start_response):
+        params = dict((k, v[0]) for k, v in parse_qs(environ.get('QUERY_STRING', '')).items())
+        if not check_secret(params.get('s'), self.admin_secret):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return [b'Forbidden']
+
+        base_url = '%s?%s' % (self.profiles_path, urlencode({'s': self.admin_secret}))
+        route = params.get('route')
+        if route is None:
+            routes = self.profiles.snapshot()
+            if params.get('format') == 'json':
+                return self._respond(start_response, 'application/json',
+                                     render_routes_json(routes))
+            return self._respond(start_response, 'text/html; charset=utf-8', render_routes_html(
+                routes, lambda r: '%s&%s' % (base_url, urlencode({'route': r}))
+            ))
+
+        profile = self.profiles.get(route)
+        if profile is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+
+        fmt = params.get('format')
+        if fmt == 'prof':
+            start_response('200 OK', [
+                ('Content-Type', 'application/octet-stream'),
+                ('Content-Disposition', 'attachment; filename="backlash.prof"')
+            ])
+            return [profile.dump()]
+
+        try:
+            limit = int(params.get('limit', 50))
+        except ValueError:
+            limit = 50
+        functions = profile.functions(params.get('sort', 'cumtime'), limit)
+        if fmt == 'json':
+            return self._respond(start_response, 'application/json',
+                                 render_route_json(profile, functions))
+
+        return self._respond(start_response, 'text/html; charset=utf-8', render_route_html(
+            profile, functions,
+            lambda k: '%s&%s' % (base_url, urlencode({'route': route, 'limit': limit, 'sort': k}))
+        ))
+
+    def _respond(self, start_response, content_type, body):
+        start_response('200 OK', [('Content-Type', content_type)])
+        return [bytes_(body)]
+
@@ -0,0 +1,152 @@
+import io
+import json
+import marshal
+import pstats
+import threading
+from collections import OrderedDict
+
+from backlash._compat import text_
+from backlash.utils import escape
+
+
+SORT_KEYS = {'calls': 1, 'tottime': 2, 'cumtime': 3}
+
+
+class RouteProfile(object):
+    """Profiling results of a route, merged across the sampled requests."""
+
+    def __init__(self, route):
+        self.route = route
+        self.requests = 0
+        self.total_time = 0.0
+        self.stats = None
+        # Stats are merged by the request threads while they are read.
+        self._lock = threading.Lock()
+
+    def add(self, profiler, duration):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profiler, stream=io.StringIO())
+            else:
+                self.stats.add(profiler)
+            self.requests += 1
+            self.total_time += duration
+
+    def functions(self, sort='cumtime', limit=50):
+        """The profiled functions as dictionaries, sorted by ``sort``."""
+        index = SORT_KEYS.get(sort, SORT_KEYS['cumtime'])
+        with self._lock:
+            entries = list(self.stats.stats.items())
+        entries.sort(key=lambda e: e[1][index], reverse=True)
+        return [{'file': filename, 'line': lineno, 'function': function,
+                 'primitive_calls': cc, 'calls': nc,
+                 'tottime': round(tt, 6), 'cumtime': round(ct, 6)}
+                for (filename, lineno, function), (cc, nc, tt, ct, _) in entries[:limit]]
+
+    def dump(self):
+        """The merged stats in the format of ``pstats.Stats.dump_stats``."""
+        with self._lock:
+            return marshal.dumps(self.stats.stats)
+
+    def as_dict(self):
+        return {'route': self.route,
+                'requests': self.requests,
+                'total_time': round(self.total_time, 6),
+                'average_time': round(self.total_time / self.requests, 6)}
+
+
+class ProfilesRegistry(object):
+    """Profiles of the most recently sampled ``max_routes`` routes."""
+
+    def __init__(self, max_routes=50):
+        self.max_routes = max_routes
+        self._lock = threading.Lock()
+        self._routes = OrderedDict()
+
+    def add(self, route, profiler, duration):
+        with self._lock:
+            profile = self._routes.pop(route, None)
+            if profile is None:
+                profile = RouteProfile(route)
+                while len(self._routes) >= self.max_routes:
+                    self._routes.popitem(last=False)
+            self._routes[route] = profile
+            profile.add(profiler, duration)
+
+    def get(self, route):
+        with self._lock:
+            return self._routes.get(route)
+
+    def snapshot(self):
+        """The profiled routes, the slowest on average first."""
+        with self._lock:
+            routes = list(self._routes.values())
+        routes.sort(key=lambda r: r.total_time / r.requests, reverse=True)
+        return routes
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+PROFILES_HTML = text_('''\
+<!DOCTYPE html>
+<html>
+  <head><title>%(title)s // Backlash</title></head>
+  <body>
+    <h1>%(title)s</h1>
+    <table>
+      <tr>%(headers)s</tr>
+%(rows)s
+    </table>
+  </body>
+</html>
+''')
+
+ROUTE_ROW_HTML = text_('''\
+      <tr><td><a href="%(url)s">%(route)s</a></td><td>%(requests)d</td>
+          <td>%(total_time).3fs</td><td>%(average_time).3fs</td></tr>''')
+
+FUNCTION_ROW_HTML = text_('''\
+      <tr><td>%(function)s</td><td>%(file)s:%(line)d</td><td>%(calls)d/%(primitive_calls)d</td>
+          <td>%(tottime).6f</td><td>%(cumtime).6f</td></tr>''')
+
+
+def render_routes_html(routes, route_url):
+    """Render the list of profiled routes, ``route_url`` builds the url of each route."""
+    rows = []
+    for route in routes:
+        values = route.as_dict()
+        values.update({'route': escape(route.route),
+                       'url': escape(route_url(route.route), True)})
+        rows.append(ROUTE_ROW_HTML % values)
+    return PROFILES_HTML % {
+        'title': '%d profiled routes' % len(routes),
+        'headers': '<th>Route</th><th>Requests</th><th>Total</th><th>Average</th>',
+        'rows': text_('\n'.join(rows))
+    }
+
+
+def render_route_html(profile, functions, sort_url):
+    """Render the functions of a profile, ``sort_url`` builds the url of each sort key."""
+    rows = []
+    for function in functions:
+        values = dict(function, function=escape(function['function']),
+                      file=escape(function['file']))
+        rows.append(FUNCTION_ROW_HTML % values)
+    headers = ['<th>Function</th><th>Location</th>']
+    for key in ('calls', 'tottime', 'cumtime'):
+        headers.append('<th><a href="%s">%s</a></th>' % (escape(sort_url(key), True), key))
+    return PROFILES_HTML % {
+        'title': '%s (%d requests)' % (escape(profile.route), profile.requests),
+        'headers': text_(''.join(headers)),
+        'rows': text_('\n'.join(rows))
+    }
+
+
+def render_route_json(profile, functions):
+    return json.dumps(dict(profile.as_dict(), functions=functions))
+
+
+def render_routes_json(routes):
+    return json.dumps({'routes': [r.as_dict() for r in routes]})
@@ -0,0 +1,33 @@
+import io
+import json
+import threading
+
+from backlash._compat import text_
+from backlash.tracing.capture import capture_record, DEFAULT_REDACTED_HEADERS
+
+
+class CaptureReporter(object):
+    """Appends the reported requests to ``path`` in the capture format.
+
+    The captured requests can be replayed with ``python -m backlash.replay``,
+    bodies are kept only when the middleware captures them and are limited
+    to ``max_body`` bytes.  Reports that are not about a request are skipped
+    and the ``redacted_headers``, by default the cookies and credentials,
+    are never written to the file.
+    """
+
+    def __init__(self, path, max_body=64 * 1024, redacted_headers=DEFAULT_REDACTED_HEADERS,
+                 **unused):
+        self.path = path
+        self.max_body = max_body
+        self.redacted_headers = redacted_headers
+        self._lock = threading.Lock()
+
+    def report(self, traceback):
+        record = capture_record(traceback, self.max_body, self.redacted_headers)
+        if record is None:
+            return
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with io.open(self.path, 'a', encoding='utf-8') as captures:
+                captures.write(text_(line))
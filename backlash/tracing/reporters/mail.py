@@ -4,6 +4,8 @@ from email.mime.text import MIMEText
 import smtplib
 import ssl
 from backlash._compat import string_types, bytes_, text_, PY3
+from backlash.tracing.input import body_text
+from backlash.utils import EnvironSnapshot
 
 
 class EmailReporter(object):
@@ -69,13 +71,19 @@ class EmailReporter(object):
 
         return value
 
-    def _format_cgi(self, environ):
+    def _sorted_environ(self, environ):
+        if isinstance(environ, EnvironSnapshot):
+            # Snapshots are already sorted by key.
+            return list(environ.items())
+        return sorted(environ.items())
+
+    def _format_cgi(self, items):
         return '\n'.join(
-            ('\t%s: %s' % (k, self._repr_value(environ[k])) for k in sorted(environ.keys()) if k.upper() == k))
+            ('\t%s: %s' % (k, self._repr_value(v)) for k, v in items if k.upper() == k))
 
-    def _format_wsgi(self, environ):
+    def _format_wsgi(self, items):
         return '\n'.join(
-            ('\t%s: %s' % (k, self._repr_value(environ[k])) for k in sorted(environ.keys()) if k.upper() != k))
+            ('\t%s: %s' % (k, self._repr_value(v)) for k, v in items if k.upper() != k))
 
     def email_body(self, traceback):
         body = 'TRACEBACK:\n%s' % traceback.plaintext
@@ -92,12 +100,15 @@ class EmailReporter(object):
                     except Exception as e:
                         body += "<UNABLE TO PRINT VALUE>\n"
 
-        body += '\n\n\nENVIRON:\n%s' % self._format_cgi(traceback.context['environ'])
-        body += '\n\n\nWSGI:\n%s' % self._format_wsgi(traceback.context['environ'])
+        environ = self._sorted_environ(traceback.context['environ'])
+        body += '\n\n\nENVIRON:\n%s' % self._format_cgi(environ)
+        body += '\n\n\nWSGI:\n%s' % self._format_wsgi(environ)
 
         for entry, value in traceback.context.items():
             if entry == 'environ':
                 continue
+            if entry == 'REQUEST_BODY':
+                value = dict(value, Body=body_text(value.get('Body')))
 
             body += '\n\n\n%s:\n\t%r' % (entry.upper(), value)
 
@@ -118,7 +129,14 @@ class EmailReporter(object):
         msg.attach(text)
 
         request = traceback.context.get('request')
-        if self.dump_request and request is not None:
+        body = traceback.context.get('REQUEST_BODY')
+        if self.dump_request and body is not None:
+            # The body was already consumed by the application, use the captured
+            # one as it was read, it's not necessarily text.
+            part = MIMEApplication(bytes_(body['Body'])[:self.dump_request_size])
+            part.add_header('Content-Disposition', 'attachment; filename="request_body.txt"')
+            msg.attach(part)
+        elif self.dump_request and request is not None:
             part = MIMEApplication(request.as_bytes(self.dump_request_size))
             part.add_header('Content-Disposition', 'attachment; filename="request.txt"')
             msg.attach(part)
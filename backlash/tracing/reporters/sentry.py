@@ -1,40 +1,299 @@
+"""Reports to Sentry without any Sentry SDK.
+
+Events are built from backlash tracebacks and sent as envelopes to the
+ingestion endpoint of the project identified by the DSN, from a background
+thread which keeps the connection alive and honors the rate limits
+communicated by Sentry.
+"""
+import datetime as dt
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+
 try:
-    from raven.base import Client
-    from raven.utils.wsgi import get_current_url, get_headers, get_environ
-except ImportError:
-    Client = None
+    from urllib.parse import urlsplit
+except ImportError:  # pragma: no cover
+    from urlparse import urlsplit
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from backlash._compat import text_, string_types, binary_type
+from backlash.frtools import is_library_frame
+from backlash.tracing.events import _safe_repr
+from .webhook import _ConnectionPool
+
+log = logging.getLogger('backlash')
+
+CLIENT_NAME = 'backlash/0.4.1'
+
+
+class SentryRateLimited(Exception):
+    """Sentry asked to stop sending events for a while."""
+
+
+class SentryQueueFull(Exception):
+    """Events are reported faster than they can be sent."""
+
+
+def parse_dsn(dsn):
+    """The envelope endpoint and the public key of a Sentry DSN."""
+    parts = urlsplit(dsn)
+    path, _, project_id = parts.path.rstrip('/').rpartition('/')
+    if not parts.username or not project_id:
+        raise ValueError('Invalid Sentry DSN %s' % dsn)
+    netloc = parts.hostname + (':%d' % parts.port if parts.port else '')
+    endpoint = '%s://%s%s/api/%s/envelope/' % (parts.scheme, netloc, path, project_id)
+    return endpoint, parts.username
+
+
+def _frame_payload(frame, with_locals, context_lines, max_locals):
+    pre_context, context_line, post_context = frame.source_context(context_lines)
+    payload = {'filename': frame.filename,
+               'abs_path': frame.filename,
+               'function': frame.function_name,
+               'module': frame.module,
+               'lineno': frame.lineno,
+               'pre_context': [text_(l) for l in pre_context],
+               'context_line': text_(context_line),
+               'post_context': [text_(l) for l in post_context],
+               'in_app': not is_library_frame(frame)}
+    if with_locals:
+        names = sorted(frame.locals)[:max_locals]
+        payload['vars'] = dict((text_(str(k)), _safe_repr(frame.locals[k])) for k in names)
+    return payload
+
+
+def _request_payload(environ):
+    if not environ.get('REQUEST_METHOD'):
+        return None
+    host = environ.get('HTTP_HOST') or '%s:%s' % (environ.get('SERVER_NAME', ''),
+                                                  environ.get('SERVER_PORT', ''))
+    headers = dict((k[5:].replace('_', '-').title(), v) for k, v in environ.items()
+                   if k.startswith('HTTP_'))
+    for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        if environ.get(key):
+            headers[key.replace('_', '-').title()] = environ[key]
+    return {'method': environ['REQUEST_METHOD'],
+            'url': '%s://%s%s%s' % (environ.get('wsgi.url_scheme', 'http'), host,
+                                    environ.get('SCRIPT_NAME', ''), environ.get('PATH_INFO', '')),
+            'query_string': environ.get('QUERY_STRING', ''),
+            'headers': headers,
+            'env': dict((k, environ[k]) for k in ('REMOTE_ADDR', 'SERVER_NAME', 'SERVER_PORT')
+                        if k in environ)}
 
 
 class SentryReporter(object):
-    def __init__(self, sentry_dsn, **unused):
-        if Client is None:
-            raise RavenNotAvailable('Raven is not installed, maybe run "pip install raven"')
+    """Sends the reports to the Sentry project identified by ``sentry_dsn``.
+
+    The locals of the last ``locals_frames`` frames are sent, up to
+    ``max_locals`` variables each, along with ``context_lines`` lines of
+    source around each frame.  Events are queued, up to ``max_queue``,
+    and sent by a background thread.  When Sentry rate limits the client
+    new events are dropped until the time it asked to wait for, while the
+    ones already queued wait for it and are sent again, up to
+    ``max_retries`` times, if Sentry refused them.
+    """
+
+    def __init__(self, sentry_dsn, environment=None, release=None, locals_frames=5,
+                 max_locals=50, context_lines=5, timeout=10, max_queue=1000, max_retries=3,
+                 **unused):
+        self.dsn = sentry_dsn
+        self.endpoint, self.public_key = parse_dsn(sentry_dsn)
+        self.environment = environment
+        self.release = release
+        self.locals_frames = locals_frames
+        self.max_locals = max_locals
+        self.context_lines = context_lines
+        self.max_retries = max_retries
+        self.server_name = socket.gethostname()
+        self.pool = _ConnectionPool(self.endpoint, timeout, 1)
 
-        self.client = Client(sentry_dsn)
+        self.sent = 0
+        self.dropped = 0
+        self.rate_limited_until = 0
+
+        self._queue = queue.Queue(max_queue)
+        self._sender = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<SentryReporter %s>' % self.endpoint
+
+    def build_event(self, traceback):
+        """Sentry event payload of a backlash traceback."""
+        frames = traceback.frames
+        first_with_locals = len(frames) - self.locals_frames
+        stacktrace = {'frames': [
+            _frame_payload(f, idx >= first_with_locals, self.context_lines, self.max_locals)
+            for idx, f in enumerate(frames)
+        ]}
+
+        recorded = getattr(traceback, 'event', None) or {}
+        event = {'event_id': uuid.uuid4().hex,
+                 'timestamp': recorded.get('time') or time.time(),
+                 'platform': 'python',
+                 'logger': 'backlash',
+                 'server_name': self.server_name,
+                 'sdk': {'name': CLIENT_NAME.split('/')[0], 'version': CLIENT_NAME.split('/')[1]}}
+        if self.environment:
+            event['environment'] = self.environment
+        if self.release:
+            event['release'] = self.release
+
+        if getattr(traceback.exc_value, 'backlash_event', False):
+            # Stack dumps and slow requests, not real crashes.
+            event['level'] = 'warning'
+            event['message'] = {'formatted': text_(traceback.exception)}
+            event['threads'] = {'values': [{'id': 0, 'current': True, 'crashed': False,
+                                            'stacktrace': stacktrace}]}
+        else:
+            module, _, exc_type = traceback.exception_type.rpartition('.')
+            event['level'] = 'error'
+            event['exception'] = {'values': [{'type': exc_type,
+                                              'module': module or None,
+                                              'value': text_(str(traceback.exc_value)),
+                                              'stacktrace': stacktrace}]}
+
+        extra = {}
+        for key, value in (traceback.context or {}).items():
+            if key == 'environ':
+                request = _request_payload(value)
+                if request is not None:
+                    event['request'] = request
+            elif key == 'request':
+                continue
+            elif isinstance(value, dict):
+                extra[key] = dict((text_(str(k)), v if isinstance(v, string_types)
+                                   else text_(v, 'utf-8', 'replace') if isinstance(v, binary_type)
+                                   else _safe_repr(v)) for k, v in value.items())
+            else:
+                extra[key] = _safe_repr(value)
+        if extra:
+            event['extra'] = extra
+        return event
+
+    def envelope(self, event):
+        """Serialize an event as an envelope with a single item."""
+        payload = json.dumps(event).encode('utf-8')
+        header = json.dumps({'event_id': event['event_id'], 'dsn': self.dsn,
+                             'sent_at': dt.datetime.utcnow().isoformat() + 'Z'})
+        item = json.dumps({'type': 'event', 'length': len(payload),
+                           'content_type': 'application/json'})
+        return b'\n'.join([header.encode('utf-8'), item.encode('utf-8'), payload]) + b'\n'
 
     def report(self, traceback):
-        environ = traceback.context.get('environ', {})
-        data = {
-            'sentry.interfaces.Http': {
-                'method': environ.get('REQUEST_METHOD'),
-                'url': get_current_url(environ, strip_querystring=True),
-                'query_string': environ.get('QUERY_STRING'),
-                # TODO
-                # 'data': environ.get('wsgi.input'),
-                'headers': dict(get_headers(environ)),
-                'env': dict(get_environ(environ)),
-            }
-        }
-
-        is_backlash_event = getattr(traceback.exc_value, 'backlash_event', False)
-        if is_backlash_event:
-            # Just a Stack Dump request from backlash
-            self.client.captureMessage(traceback.exception, data=data,
-                                       stack=traceback.frames)
+        if time.time() < self.rate_limited_until:
+            self.dropped += 1
+            raise SentryRateLimited('rate limited for %.0fs' % (self.rate_limited_until -
+                                                                time.time()))
+
+        envelope = self.envelope(self.build_event(traceback))
+        self._ensure_sender()
+        try:
+            self._queue.put_nowait(envelope)
+        except queue.Full:
+            self.dropped += 1
+            raise SentryQueueFull('%d events waiting to be sent' % self._queue.qsize())
+
+    def _ensure_sender(self):
+        if self._sender is not None and self._sender.is_alive():
+            return
+        with self._lock:
+            if self._sender is None or not self._sender.is_alive():
+                self._sender = threading.Thread(target=self._run, name='backlash-sentry')
+                self._sender.daemon = True
+                self._sender.start()
+
+    def _run(self):
+        while True:
+            envelope = self._queue.get()
+            try:
+                self._deliver(envelope)
+            except Exception:
+                self.dropped += 1
+                log.exception('Unable to send event to Sentry at %s', self.endpoint)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, envelope):
+        for _ in range(self.max_retries + 1):
+            wait = self.rate_limited_until - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            if self.send(envelope):
+                return
+        self.dropped += 1
+        log.warning('Dropped event rate limited %d times by Sentry at %s',
+                    self.max_retries + 1, self.endpoint)
+
+    def _auth_header(self):
+        return 'Sentry sentry_version=7, sentry_client=%s, sentry_key=%s' % (CLIENT_NAME,
+                                                                               self.public_key)
+
+    def send(self, envelope):
+        """Send an envelope, ``False`` when Sentry refused it for rate limits."""
+        headers = {'Content-Type': 'application/x-sentry-envelope',
+                   'Content-Length': str(len(envelope)),
+                   'X-Sentry-Auth': self._auth_header()}
+
+        connection = self.pool.acquire()
+        try:
+            connection.request('POST', self.pool.path, envelope, headers)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
         else:
-            # This is a real crash
-            self.client.captureException(exc_info=traceback.exc_info, data=data)
+            self.pool.release(connection)
+
+        self._update_rate_limits(response)
+        if response.status == 429:
+            return False
+        elif response.status >= 300:
+            raise IOError('Sentry responded %d %s' % (response.status, response.reason))
+        self.sent += 1
+        return True
+
+    def _update_rate_limits(self, response):
+        retry_after = None
+        limits = response.getheader('X-Sentry-Rate-Limits')
+        if limits:
+            for limit in limits.split(','):
+                fields = limit.strip().split(':')
+                categories = fields[1].split(';') if len(fields) > 1 else []
+                if categories and categories != [''] and 'error' not in categories:
+                    continue
+                try:
+                    retry_after = max(retry_after or 0, float(fields[0]))
+                except ValueError:
+                    continue
+        elif response.status == 429:
+            try:
+                retry_after = float(response.getheader('Retry-After', 60))
+            except ValueError:
+                retry_after = 60.0
+
+        if retry_after is not None:
+            self.rate_limited_until = time.time() + retry_after
+
+    def flush(self, timeout=None):
+        """Wait until the queued events are sent, or ``timeout`` seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
 
 
 class RavenNotAvailable(Exception):
-    pass
\ No newline at end of file
+    """Kept for backward compatibility, raven is not required anymore."""
@@ -0,0 +1,264 @@
+import gzip
+import io
+import json
+import logging
+import random
+import threading
+import time
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlsplit
+except ImportError:  # pragma: no cover
+    import httplib
+    from urlparse import urlsplit
+
+try:
+    import queue
+except ImportError:  # pragma: no cover
+    import Queue as queue
+
+from backlash.tracing.events import serialize_traceback, EventTraceback
+from backlash.tracing.spool import Spool
+
+log = logging.getLogger('backlash')
+
+
+class WebhookQueueFull(Exception):
+    """Events are reported faster than they can be sent."""
+
+
+class WebhookUnavailable(Exception):
+    """A batch couldn't be sent recently, the endpoint is likely down."""
+
+
+class WebhookError(httplib.HTTPException):
+    """The endpoint refused the events."""
+
+    def __init__(self, message, status):
+        super(WebhookError, self).__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        # Server errors and rate limits are temporary, other errors won't
+        # change by sending the same events again.
+        return self.status >= 500 or self.status == 429
+
+
+class _ConnectionPool(object):
+    """Keeps alive up to ``size`` connections to the same host."""
+
+    def __init__(self, url, timeout, size):
+        parts = urlsplit(url)
+        self.connection_class = (httplib.HTTPSConnection if parts.scheme == 'https'
+                                 else httplib.HTTPConnection)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class WebhookReporter(object):
+    """Posts the reports to an HTTP endpoint as gzip compressed JSON arrays.
+
+    Reports are serialized as events of :mod:`backlash.tracing.events` and
+    queued, a background thread sends them in batches of up to ``batch_size``
+    events or ``batch_bytes`` bytes, waiting at most ``flush_interval``
+    seconds for a batch to fill.  ``pool_size`` threads send the batches,
+    each one over a kept alive connection.  Requests that fail because of
+    connection errors, server errors or rate limits are retried ``retries``
+    times after a randomized exponential backoff starting at ``backoff``.
+
+    When more than ``max_queue`` events are waiting to be sent, reports fail
+    with :class:`WebhookQueueFull`.  Once a batch can't be sent, reports fail
+    right away with :class:`WebhookUnavailable` for ``failure_interval``
+    seconds, without any network activity, so that the circuit breaker and
+    the spool of the middlewares take over; then events are queued again.
+    The events of the batches that failed are kept in ``spool_dir``, when
+    provided, and sent again later, otherwise they are dropped.
+    """
+
+    def __init__(self, url, headers=None, batch_size=50, batch_bytes=512 * 1024,
+                 flush_interval=2.0, timeout=10, retries=3, backoff=0.5, pool_size=2,
+                 max_queue=1000, compress_level=6, spool_dir=None, failure_interval=30,
+                 **unused):
+        self.url = url
+        self.headers = dict(headers or {})
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.compress_level = compress_level
+        self.pool_size = pool_size
+        self.failure_interval = failure_interval
+        self.pool = _ConnectionPool(url, timeout, pool_size)
+        self.spool = Spool(spool_dir, [self]) if spool_dir else None
+
+        self.sent = 0
+        self.dropped = 0
+        self.spooled = 0
+        # Set when a batch couldn't be sent, until an event is sent again.
+        self.failing = False
+        self._failed_at = 0
+
+        self._queue = queue.Queue(max_queue)
+        self._senders = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<WebhookReporter %s>' % self.url
+
+    def report(self, traceback):
+        if self.failing and time.time() - self._failed_at < self.failure_interval:
+            # Don't queue events that would likely be lost, the failure
+            # is reported to the caller instead.
+            raise WebhookUnavailable('unable to send events to %s for %.0fs' % (
+                self.url, time.time() - self._failed_at))
+
+        event = json.dumps(serialize_traceback(traceback))
+        self._ensure_senders()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            raise WebhookQueueFull('%d events waiting to be sent' % self._queue.qsize())
+
+    def _ensure_senders(self):
+        if len(self._senders) == self.pool_size and all(s.is_alive() for s in self._senders):
+            return
+        with self._lock:
+            self._senders = [s for s in self._senders if s.is_alive()]
+            while len(self._senders) < self.pool_size:
+                sender = threading.Thread(target=self._run, name='backlash-webhook')
+                sender.daemon = True
+                sender.start()
+                self._senders.append(sender)
+
+    def _next_batch(self):
+        """Wait for the events of the next batch, the first one without timeout."""
+        batch = [self._queue.get()]
+        size = len(batch[0])
+        deadline = time.time() + self.flush_interval
+        while len(batch) < self.batch_size and size < self.batch_bytes:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                event = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(event)
+            size += len(event)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.send(batch)
+            except Exception:
+                self.failing = True
+                self._failed_at = time.time()
+                self._failed(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _failed(self, batch):
+        if self.spool is None:
+            self.dropped += len(batch)
+            log.exception('Unable to send %d events to %s, dropped', len(batch), self.url)
+            return
+
+        log.warning('Unable to send %d events to %s, spooled', len(batch), self.url,
+                    exc_info=True)
+        for event in batch:
+            try:
+                self.spool.store(self, EventTraceback(json.loads(event)))
+                self.spooled += 1
+            except Exception:
+                self.dropped += 1
+                log.exception('Unable to spool event for %s', self.url)
+
+    def encode(self, events):
+        body = io.BytesIO()
+        with gzip.GzipFile(fileobj=body, mode='wb', compresslevel=self.compress_level) as data:
+            data.write(('[%s]' % ','.join(events)).encode('utf-8'))
+        return body.getvalue()
+
+    def send(self, events):
+        """Post a batch of serialized events, retrying on failures."""
+        body = self.encode(events)
+        headers = {'Content-Type': 'application/json',
+                   'Content-Encoding': 'gzip',
+                   'Content-Length': str(len(body))}
+        headers.update(self.headers)
+
+        attempt = 0
+        while True:
+            try:
+                self._post(body, headers)
+                self.sent += len(events)
+                self.failing = False
+                return
+            except Exception as e:
+                if attempt >= self.retries or not getattr(e, 'retryable', True):
+                    raise
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                log.debug('Sending events to %s failed (%s), retrying in %.2fs',
+                          self.url, e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _post(self, body, headers):
+        connection = self.pool.acquire()
+        try:
+            connection.request('POST', self.pool.path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(connection)
+
+        if response.status >= 300:
+            raise WebhookError('%s responded %d %s' % (self.url, response.status,
+                                                       response.reason), response.status)
+
+    def flush(self, timeout=None):
+        """Wait until the queued events are sent, or ``timeout`` seconds."""
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
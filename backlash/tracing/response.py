@@ -0,0 +1,94 @@
+class ClosingIterable(object):
+    """Passthrough of the iterable returned by a WSGI application.
+
+    Iterating it returns the iterator of the original iterable, so chunks
+    don't go through any additional Python code.  ``close()`` is forwarded
+    to the original iterable and then ``on_close`` is called.
+    """
+
+    def __init__(self, app_iter, on_close):
+        self.app_iter = app_iter
+        self._on_close = on_close
+        self._closed = False
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            self._on_close()
+
+
+class SizedClosingIterable(ClosingIterable):
+    """:class:`ClosingIterable` of a sized iterable, like a list of chunks.
+
+    Servers call ``len()`` on any response that has ``__len__`` to set
+    Content-Length for single chunk responses, so only sized iterables
+    are wrapped by this class.
+    """
+
+    def __len__(self):
+        return len(self.app_iter)
+
+
+class _ClosingFile(object):
+    """File-like proxy that calls ``on_close`` after the file is closed."""
+
+    def __init__(self, filelike, on_close):
+        self._filelike = filelike
+        self._on_close = on_close
+        self._closed = False
+
+    def __getattr__(self, item):
+        # fileno, read, seek, tell... are required by servers to sendfile.
+        return getattr(self._filelike, item)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._filelike, 'close'):
+                self._filelike.close()
+        finally:
+            self._on_close()
+
+
+def is_sequence(app_iter):
+    """Whether iterating ``app_iter`` can't run application code."""
+    return isinstance(app_iter, (list, tuple))
+
+
+def get_file_wrapper(environ, app_iter):
+    """Return the ``wsgi.file_wrapper`` class if ``app_iter`` is an instance of it."""
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if isinstance(file_wrapper, type) and isinstance(app_iter, file_wrapper):
+        return file_wrapper
+    return None
+
+
+def close_response(environ, app_iter, on_close):
+    """Return an iterable with the same content of ``app_iter`` that calls
+    ``on_close`` when the server closes the response.
+
+    Responses served through ``wsgi.file_wrapper`` are wrapped again by the
+    server file wrapper, so that servers can still use ``sendfile``.  Any
+    other response is wrapped by a :class:`ClosingIterable`, which is sized
+    only when ``app_iter`` is.
+    """
+    file_wrapper = get_file_wrapper(environ, app_iter)
+    filelike = getattr(app_iter, 'filelike', None)
+    if file_wrapper is not None and filelike is not None:
+        args = (_ClosingFile(filelike, on_close), )
+        if hasattr(app_iter, 'blksize'):
+            args += (app_iter.blksize, )
+        return file_wrapper(*args)
+    if hasattr(app_iter, '__len__'):
+        return SizedClosingIterable(app_iter, on_close)
+    return ClosingIterable(app_iter, on_close)
@@ -0,0 +1,60 @@
+import asyncio
+
+from backlash.tracing.inflight import inflight_requests
+from backlash.utils import environ_from_scope
+from .loop import EventLoopWatchdog
+
+
+class ASGITraceSlowRequestsMiddleware(object):
+    """Reports slow requests and event loop stalls of ASGI applications.
+
+    As all the requests share the event loop thread, slow requests are
+    reported with the stack of the task serving them, while an
+    :class:`EventLoopWatchdog` reports the loop thread stack whenever the
+    loop gets blocked for more than ``loop_stall_interval`` seconds.
+    """
+
+    def __init__(self, app, reporters, context_injectors, interval=25,
+                 exclude_paths=None, registry=None, loop_stall_interval=1.0,
+                 environ_policy=None):
+        self.app = app
+        self.reporters = reporters
+        self.context_injectors = context_injectors
+        self.interval = interval
+        self.exclude_paths = exclude_paths or []
+        self.registry = registry if registry is not None else inflight_requests
+        self.loop_stall_interval = loop_stall_interval
+        self.environ_policy = environ_policy
+        self.watchdog = None
+
+    def _start_watchdog(self):
+        loop = asyncio.get_running_loop()
+        if self.watchdog is not None and self.watchdog.loop is loop:
+            return
+        if self.watchdog is not None:
+            self.watchdog.stop()
+
+        self.watchdog = EventLoopWatchdog(loop, self.reporters,
+                                          threshold=self.loop_stall_interval,
+                                          registry=self.registry,
+                                          slow_task_interval=self.interval,
+                                          context_injectors=self.context_injectors,
+                                          environ_policy=self.environ_policy)
+        self.watchdog.start()
+
+    def _is_exempt(self, path):
+        for excluded_p in self.exclude_paths:
+            if path.startswith(excluded_p):
+                return True
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self._is_exempt(scope.get('path', '')):
+            return await self.app(scope, receive, send)
+
+        self._start_watchdog()
+        request = self.registry.begin(environ_from_scope(scope), task=asyncio.current_task())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.registry.end(request)
@@ -0,0 +1,58 @@
+import threading
+import time
+from collections import OrderedDict
+
+from backlash.frtools import stack_fingerprint
+
+
+class SlowRequestsCoalescer(object):
+    """Groups slow requests that are stuck at the same point.
+
+    Stacks added within ``window`` seconds of the first one are bucketed
+    by the fingerprint of their innermost application frames, then
+    ``deliver`` is called once for each bucket with a single traceback:
+    the one of the oldest request, with the paths, the count and the ages
+    (at delivery time) of all the requests in the bucket added to its context.
+    """
+
+    def __init__(self, timer, deliver, window=2, group_depth=5):
+        self.timer = timer
+        self.deliver = deliver
+        self.window = window
+        self.group_depth = group_depth
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def add(self, traceback, started, errors):
+        key = stack_fingerprint(traceback.frames, self.group_depth)
+        with self._lock:
+            if not self._buckets:
+                self.timer.run_later(self.flush, self.window)
+            self._buckets.setdefault(key, []).append((traceback, started, errors))
+
+    def flush(self):
+        with self._lock:
+            buckets, self._buckets = self._buckets, OrderedDict()
+
+        now = time.time()
+        for members in buckets.values():
+            traceback, _, errors = min(members, key=lambda m: m[1])
+            if len(members) > 1:
+                traceback.context['SLOW_REQUESTS_GROUP'] = self.describe(members, now)
+            self.deliver(traceback, errors)
+
+    @staticmethod
+    def describe(members, now):
+        ages = sorted(now - m[1] for m in members)
+        paths = OrderedDict()
+        for traceback, _, _ in members:
+            path = str(traceback.exc_value)
+            paths[path] = paths.get(path, 0) + 1
+
+        return {'Count': len(members),
+                'Paths': ', '.join('%s (%d)' % p for p in paths.items()),
+                'MinAge': '%.3fs' % ages[0],
+                'MedianAge': '%.3fs' % ages[len(ages) // 2],
+                'P90Age': '%.3fs' % ages[min(len(ages) - 1, int(len(ages) * 0.9))],
+                'MaxAge': '%.3fs' % ages[-1]}
@@ -0,0 +1,172 @@
+import asyncio
+import datetime as dt
+import os
+import sys
+import threading
+import time
+
+from backlash.frtools import get_thread_stack, get_task_stack
+from backlash.tracing.delivery import deliver
+from backlash.utils import RequestContext, default_environ_policy
+from .timer import Timer
+
+import logging
+log = logging.getLogger('backlash')
+
+
+class EventLoopWatchdog(threading.Thread):
+    """Detects when an asyncio event loop gets blocked.
+
+    A monitor thread schedules a heartbeat on the ``loop`` every
+    ``heartbeat`` seconds and measures how late it runs.  When the loop
+    doesn't run the heartbeat for ``threshold`` seconds, the stack of
+    the loop thread is reported through ``reporters``.
+
+    When a ``registry`` of in-flight requests is provided, requests served
+    by tasks running for more than ``slow_task_interval`` seconds are
+    reported with the stack of their task, captured by the loop itself.
+
+    Reports are delivered by a separate thread, so slow reporters neither
+    delay the detection of stalls nor block the loop.
+
+    The environ entries kept by the reports are chosen by ``environ_policy``,
+    a :class:`backlash.utils.EnvironSnapshotPolicy`.
+    """
+
+    def __init__(self, loop, reporters, threshold=1.0, heartbeat=None, registry=None,
+                 slow_task_interval=None, context_injectors=None, environ_policy=None):
+        super(EventLoopWatchdog, self).__init__(name='backlash-loop-watchdog')
+        self.daemon = True
+        self.loop = loop
+        self.reporters = reporters
+        self.threshold = threshold
+        self.heartbeat = heartbeat or threshold / 4.0
+        self.registry = registry
+        self.slow_task_interval = slow_task_interval
+        self.context_injectors = context_injectors or []
+        self.environ_policy = environ_policy or default_environ_policy
+
+        self.loop_thread_id = None
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+        self._pending = None
+        self._stall_reported = False
+        self._reported_tasks = set()
+        self._stop = threading.Event()
+        self._reporter = Timer(name='backlash-loop-reporter')
+        self._reporter.daemon = True
+
+    def stop(self):
+        self._stop.set()
+        self._reporter.shutdown()
+
+    def run(self):
+        self._reporter.start()
+        while not self._stop.wait(self.heartbeat):
+            if self.loop.is_closed():
+                return
+            self._check_loop()
+            if self.registry is not None and self.slow_task_interval is not None:
+                self._check_tasks()
+
+    def _beat(self, sent):
+        # Runs in the event loop thread.
+        self.loop_thread_id = threading.current_thread().ident
+        self.lag = time.monotonic() - sent
+        self.max_lag = max(self.max_lag, self.lag)
+        self._pending = None
+        self._stall_reported = False
+
+    def _check_loop(self):
+        now = time.monotonic()
+        pending = self._pending
+        if pending is None:
+            self._pending = now
+            try:
+                self.loop.call_soon_threadsafe(self._beat, now)
+            except RuntimeError:
+                # Loop was closed in the mean time
+                self._pending = None
+        elif now - pending >= self.threshold and not self._stall_reported:
+            self._stall_reported = True
+            self.stalls += 1
+            self._report_stall(now - pending)
+
+    def _current_request(self):
+        task = asyncio.current_task(self.loop) if self.registry is not None else None
+        if task is not None:
+            for request in self.registry.snapshot():
+                if request.task is task:
+                    return request
+        return None
+
+    def _context(self, request, details):
+        environ = request.environ if request is not None else {}
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ or {})})
+        if request is not None:
+            for injector in self.context_injectors:
+                context.update(injector(environ))
+        context.update(details)
+        return context
+
+    def _report_stall(self, blocked):
+        if self.loop_thread_id is None:
+            # The loop never ran a heartbeat, its thread is unknown.
+            return
+
+        request = self._current_request()
+        context = self._context(request, {
+            'EVENT_LOOP': {'ThreadID': self.loop_thread_id,
+                           'ProcessID': os.getpid(),
+                           'Blocked': '%.3fs' % blocked,
+                           'MaxLag': '%.3fs' % self.max_lag,
+                           'Request': request.describe() if request is not None else None}
+        })
+        try:
+            traceback = get_thread_stack(self.loop_thread_id,
+                                         'Event loop blocked for more than %.3fs' % blocked,
+                                         context=context, error_type='EventLoopBlocked')
+        except KeyError:
+            return
+        self._report(traceback, 'event loop stall')
+
+    def _check_tasks(self):
+        now = time.time()
+        in_flight = set()
+        for request in self.registry.snapshot():
+            in_flight.add(request.id)
+            if request.task is None or request.id in self._reported_tasks:
+                continue
+            if now - request.started < self.slow_task_interval:
+                continue
+
+            self._reported_tasks.add(request.id)
+            context = self._context(request, {
+                'SLOW_REQUEST': {'ProcessID': os.getpid(),
+                                 'Task': repr(request.task),
+                                 'Started': str(dt.datetime.utcfromtimestamp(request.started))}
+            })
+            try:
+                self.loop.call_soon_threadsafe(self._capture_task, request, context)
+            except RuntimeError:
+                # Loop was closed in the mean time
+                return
+        self._reported_tasks &= in_flight
+
+    def _capture_task(self, request, context):
+        # Runs in the event loop thread, where the task can't be resumed
+        # while its stack is walked.
+        if request.task.done():
+            return
+        traceback = get_task_stack(request.task, request.path,
+                                   context=context, error_type='SlowRequestError')
+        self._report(traceback, 'slow request')
+
+    def _report(self, traceback, what):
+        try:
+            self._reporter.run_later(deliver, 0, self.reporters, traceback, sys.stderr, what)
+        except RuntimeError:
+            # The watchdog was stopped in the mean time
+            pass
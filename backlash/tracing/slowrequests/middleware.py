@@ -1,33 +1,142 @@
 import datetime as dt
 import os
+import sys
+import time
+import signal
 import threading
 import logging
 
-
+from backlash._compat import bytes_
 from backlash.tbtools import get_current_traceback
-from backlash.frtools import get_thread_stack, DumpThread
-from backlash.utils import RequestContext
+from backlash.tracing.delivery import deliver, guard_reporters
+from backlash.tracing.spool import Spool
+from backlash.frtools import get_handle_stack, get_stack_handle, get_thread_id, dump_threads
+from backlash.tracing.input import install_input_tee, body_context
+from backlash.tracing.inflight import (InflightRequest, inflight_requests, render_inflight_html,
+                                       render_inflight_json)
+from backlash.tracing.response import is_sequence, get_file_wrapper, close_response
+from backlash.utils import RequestContext, default_environ_policy, check_secret
+from .coalesce import SlowRequestsCoalescer
+from .saturation import SaturationWatchdog
 from .timer import Timer
 
+try:
+    from urllib.parse import parse_qs, urlencode
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qs
+    from urllib import urlencode
+
 
 class TraceSlowRequestsMiddleware(object):
+    """Reports requests that are slow to respond.
+
+    Requests are reported when they don't send the first byte of the response
+    within ``interval`` seconds (previous versions applied ``interval`` to
+    the whole request, provide the same ``total_interval`` to keep doing
+    so).  Streamed responses can also be reported when they take more than
+    ``total_interval`` seconds to complete or when more than
+    ``stall_interval`` seconds pass between two chunks, both checks are
+    disabled by default as long downloads and event streams are expected
+    to last long.
+
+    Requests in progress are tracked in ``registry`` (the process wide
+    :data:`backlash.tracing.inflight.inflight_requests` by default), which
+    is used to label threads when the stack of the whole process is dumped.
+
+    A stack dump of all the threads can be reported by sending the
+    ``dump_signal`` signal to the process or by requesting ``dump_path``
+    with the ``admin_secret`` as the ``s`` query string parameter.
+
+    The requests in progress are listed at ``inflight_path``, protected by
+    the same ``admin_secret``, as HTML or as JSON when ``format=json`` is
+    provided.  The stack of a single request can be grabbed from there.
+
+    When the number of worker threads of the server is provided as
+    ``capacity``, a :class:`.saturation.SaturationWatchdog` reports a single
+    incident when more than ``saturation_threshold`` of the workers are busy
+    for ``saturation_duration`` seconds, and slow requests are not reported
+    one by one until the saturation ends, those still in progress afterwards
+    are then reported.  Requests to ``exclude_paths`` are not accounted
+    as busy workers.
+
+    When ``coalesce_window`` is provided, slow requests detected within
+    that many seconds of each other and stuck at the same point of the
+    application are sent as a single report listing their paths and ages.
+
+    The environ entries kept by the reports are chosen by ``environ_policy``,
+    a :class:`backlash.utils.EnvironSnapshotPolicy`.  The first ``capture_body``
+    bytes of the request body read by the application are reported too.
+
+    When ``reporter_timeout`` is provided, reporters have that many seconds
+    to complete each report and are disabled for a while when they keep
+    failing, see :class:`backlash.tracing.delivery.CircuitBreaker`.  Reports
+    that could not be delivered are kept in ``spool_dir``, when provided,
+    and delivered again once the reporters recover.
+    """
 
     def __init__(self, app, reporters, context_injectors, interval=25,
-                 exclude_paths=None):
+                 exclude_paths=None, registry=None, dump_path=None,
+                 dump_signal=None, admin_secret=None, inflight_path=None,
+                 total_interval=None, stall_interval=None, capacity=None,
+                 saturation_threshold=0.9, saturation_duration=10, coalesce_window=None,
+                 environ_policy=None, capture_body=0, reporter_timeout=None,
+                 spool_dir=None):
 
         self.app = app
-        self.reporters = reporters
+        self.reporters = guard_reporters(reporters, reporter_timeout)
+        self.spool = Spool(spool_dir, self.reporters) if spool_dir else None
         self.context_injectors = context_injectors
         self.interval = interval
+        self.total_interval = total_interval
+        self.stall_interval = stall_interval
         self.exclude_paths = exclude_paths or []
+        self.registry = registry if registry is not None else inflight_requests
+        self.environ_policy = environ_policy or default_environ_policy
+        self.capture_body = capture_body
+
+        if (dump_path is not None or inflight_path is not None) and not admin_secret:
+            raise ValueError("Backlash admin paths require the admin_secret setting")
+        self.dump_path = dump_path
+        self.inflight_path = inflight_path
+        self.admin_secret = admin_secret
 
         self.timer = Timer()
         self.timer.daemon = True
         self.timer.start()
 
-    def _stream_response(self, environ, data):
+        self.coalescer = None
+        if coalesce_window:
+            self.coalescer = SlowRequestsCoalescer(self.timer, self._report_slow_request,
+                                                   coalesce_window)
+
+        self.saturation = None
+        if capacity is not None:
+            self.saturation = SaturationWatchdog(self.timer, self.registry, self.reporters,
+                                                 capacity, saturation_threshold,
+                                                 saturation_duration)
+            self.saturation.start()
+
+        if dump_signal is not None:
+            self._install_dump_signal(dump_signal)
+
+    def _wrap_response(self, environ, data, request):
+        if is_sequence(data):
+            request.bytes_sent = sum(map(len, data))
+        elif get_file_wrapper(environ, data) is None:
+            # Time and count the chunks of streamed responses while they are consumed.
+            return self._stream_response(environ, data, request)
+
+        # The whole body is available as soon as the application returns.
+        request.first_byte_at = request.last_chunk_at = time.time()
+        return close_response(environ, data, lambda: self._cancel_tracing(environ))
+
+    def _stream_response(self, environ, data, request):
         try:
             for chunk in data:
+                request.last_chunk_at = now = time.time()
+                if request.first_byte_at is None:
+                    request.first_byte_at = now
+                request.bytes_sent += len(chunk)
                 yield chunk
         finally:
             if hasattr(data, 'close'):
@@ -35,26 +144,44 @@ class TraceSlowRequestsMiddleware(object):
             self._cancel_tracing(environ)
 
     def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        if path == self.dump_path:
+            return self._serve_admin(self._serve_dump, environ, start_response)
+        elif path == self.inflight_path:
+            return self._serve_admin(self._serve_inflight, environ, start_response)
+
+        if self.capture_body:
+            install_input_tee(environ, self.capture_body)
+
         try:
-            self._start_tracing(environ)
-            return self._stream_response(environ, self.app(environ, start_response))
+            request = self._start_tracing(environ)
+
+            def _start_response(status, headers, exc_info=None):
+                request.headers_at = time.time()
+                return start_response(status, headers, exc_info)
+
+            return self._wrap_response(environ, self.app(environ, _start_response), request)
         except Exception:
             self._cancel_tracing(environ)
             raise
 
-    def peek(self, environ, thread_id, started):
-        context = RequestContext({'environ': dict(environ)})
+    def peek(self, environ, thread_id, started, reasons=None, request=None):
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ)})
+        context.update(body_context(environ))
         for injector in self.context_injectors:
             context.update(injector(environ))
 
-        context.update({
-            'SLOW_REQUEST': {'ThreadID': thread_id,
-                             'ProcessID': os.getpid(),
-                             'Started': str(started)}
-        })
+        slow_request = {'ThreadID': thread_id,
+                        'ProcessID': os.getpid(),
+                        'Started': str(started)}
+        if reasons:
+            slow_request['Reason'] = ', '.join(reasons)
+        if request is not None:
+            slow_request.update(request.timings())
+        context.update({'SLOW_REQUEST': slow_request})
 
         try:
-            traceback = get_thread_stack(thread_id, environ.get('PATH_INFO', ''),
+            traceback = get_handle_stack(thread_id, environ.get('PATH_INFO', ''),
                                          context=context, error_type='SlowRequestError')
         except KeyError:
             logging.warn('\nUnable to retrieve SlowRequest Stack %s, '
@@ -62,17 +189,115 @@ class TraceSlowRequestsMiddleware(object):
                          environ.get('PATH_INFO', ''), thread_id)
             return
 
-        for r in self.reporters:
-            try:
-                r.report(traceback)
-            except Exception:
-                error = get_current_traceback(skip=1, show_hidden_frames=False)
-                environ['wsgi.errors'].write('\nError while reporting slow request with %s\n' % r)
-                environ['wsgi.errors'].write(error.plaintext)
+        if self.coalescer is not None:
+            self.coalescer.add(traceback, request.started if request is not None else time.time(),
+                               environ['wsgi.errors'])
+        else:
+            self._report_slow_request(traceback, environ['wsgi.errors'])
+
+    def _report_slow_request(self, traceback, errors):
+        self._report(traceback, errors, 'slow request')
+
+    def _report(self, traceback, errors, what):
+        deliver(self.reporters, traceback, errors, what, self.spool)
+
+    def dump(self, description='', environ=None, current_frame=None):
+        """Report the stacks of all the threads, labelled with their requests."""
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ or {})})
+        context.update({
+            'STACK_DUMP': {'ProcessID': os.getpid(),
+                           'Requests': len(self.registry),
+                           'Taken': str(dt.datetime.utcnow())}
+        })
+        return dump_threads(self.registry, description, context=context,
+                            current_frame=current_frame)
+
+    def _serve_admin(self, view, environ, start_response):
+        params = dict((k, v[0]) for k, v in parse_qs(environ.get('QUERY_STRING', '')).items())
+        if not check_secret(params.get('s'), self.admin_secret):
+            start_response('403 Forbidden', [('Content-Type', 'text/plain')])
+            return [b'Forbidden']
+
+        content_type, body = view(environ, params)
+        if body is None:
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+
+        start_response('200 OK', [('Content-Type', content_type)])
+        return [bytes_(body)]
+
+    def _serve_dump(self, environ, params):
+        # The query string holds the admin secret, it must not end in reports.
+        traceback = self.dump('Stack dump requested from %s' % self.dump_path,
+                              dict(environ, QUERY_STRING=''))
+        self._report(traceback, environ['wsgi.errors'], 'stack dump')
+        return 'text/plain; charset=utf-8', traceback.plaintext
+
+    def _serve_inflight(self, environ, params):
+        stack = params.get('stack')
+        if stack is not None:
+            request = self.registry.get(int(stack)) if stack.isdigit() else None
+            if request is None:
+                return None, None
+            traceback = self.grab_stack(request)
+            if traceback is None:
+                return None, None
+            return 'text/plain; charset=utf-8', traceback.plaintext
+
+        requests = self.registry.snapshot()
+        if params.get('format') == 'json':
+            return 'application/json', render_inflight_json(requests)
+
+        def stack_url(request_id):
+            return '%s?%s' % (self.inflight_path, urlencode([('s', self.admin_secret),
+                                                             ('stack', request_id)]))
+        return 'text/html; charset=utf-8', render_inflight_html(requests, stack_url)
+
+    def grab_stack(self, request):
+        """Report the current stack of a request in progress."""
+        environ = request.environ or {}
+        context = RequestContext({'environ': self.environ_policy.snapshot(environ)})
+        context.update(body_context(environ))
+        for injector in self.context_injectors:
+            context.update(injector(environ))
+
+        context.update({
+            'STACK_GRAB': {'ThreadID': request.thread_id,
+                           'ProcessID': os.getpid(),
+                           'Started': str(dt.datetime.utcfromtimestamp(request.started)),
+                           'BytesSent': request.bytes_sent}
+        })
+
+        try:
+            handle = request.task if request.task is not None else request.thread_id
+            traceback = get_handle_stack(handle, request.path,
+                                         context=context, error_type='StackGrab')
+        except KeyError:
+            return None
+
+        self._report(traceback, environ.get('wsgi.errors', sys.stderr), 'stack grab')
+        return traceback
+
+    def _install_dump_signal(self, signum):
+        def _dump_on_signal(signum, frame):
+            # Stacks are captured right away, building and delivering the
+            # report happens in a thread to get out of the signal handler.
+            traceback = self.dump('Stack dump requested by signal %s' % signum,
+                                  current_frame=frame)
+            reporter = threading.Thread(target=self._report,
+                                        args=(traceback, sys.stderr, 'stack dump'))
+            reporter.daemon = True
+            reporter.start()
+
+        try:
+            signal.signal(signum, _dump_on_signal)
+        except ValueError:
+            logging.warn('Unable to install stack dump handler for signal %s, '
+                         'it can only be done from the main thread', signum)
 
     @classmethod
     def _get_thread_id(cls):
-        return threading.current_thread().ident
+        return get_stack_handle()
 
     def _is_exempt(self, environ):
         """
@@ -90,23 +315,90 @@ class TraceSlowRequestsMiddleware(object):
         return False
 
     def _start_tracing(self, environ):
-        if not self._is_exempt(environ):
-            job = self.timer.run_later(self.peek,
-                                       self.interval,
-                                       environ,
-                                       self._get_thread_id(),
-                                       dt.datetime.utcnow())
-            # In some cases due to webob.Request.call_application() or
-            # paste StatusCodeRedirect middleware multiple _start_tracing for the same
-            # environ might happen without consuming the app_iter for the firsts
-            # and so without canceling them, we register them and cancel them all together.
-            environ.setdefault('BACKLASH_SLOW_TRACING_JOBS', []).append(job)
+        requests = environ.setdefault('BACKLASH_INFLIGHT_REQUESTS', [])
+        if requests:
+            # The same environ is served again, like by webob.Request.call_application()
+            # or paste StatusCodeRedirect, it's still the same request in progress.
+            return requests[-1]
+
+        if self._is_exempt(environ):
+            # Excluded requests, like long polling ones, are expected to last long
+            # so they are timed but not accounted as in progress.
+            request = InflightRequest(get_thread_id(), environ.get('PATH_INFO', ''),
+                                      environ.get('REQUEST_METHOD', ''), time.time(), environ)
+            requests.append(request)
+            return request
+
+        handle = self._get_thread_id()
+        # Under gevent and eventlet the handle is the greenlet serving the request.
+        request = self.registry.begin(environ, thread_id=get_thread_id(),
+                                      task=None if isinstance(handle, int) else handle)
+        requests.append(request)
+        self._schedule_check(environ, request, handle, frozenset())
+        return request
+
+    def _next_check(self, request, reported):
+        """When the request might next exceed one of the thresholds."""
+        deadlines = []
+        if request.first_byte_at is None and 'time to first byte' not in reported:
+            deadlines.append(request.started + self.interval)
+        if self.total_interval is not None and 'total time' not in reported:
+            deadlines.append(request.started + self.total_interval)
+        if (self.stall_interval is not None and request.first_byte_at is not None
+                and 'stalled' not in reported):
+            deadlines.append(request.last_chunk_at + self.stall_interval)
+        return min(deadlines) if deadlines else None
+
+    def _schedule_check(self, environ, request, thread_id, reported, delay=None):
+        if delay is None:
+            deadline = self._next_check(request, reported)
+            if deadline is None:
+                return
+            delay = max(deadline - time.time(), 0)
+
+        job = self.timer.run_later(self._check, delay, environ, request, thread_id, reported)
+        # Checks are scheduled again by the timer thread, so they are kept in
+        # the request instead of the environ that the request thread is using.
+        request.checks = [j for j in request.checks if not j.is_finished()] + [job]
+
+    def _check(self, environ, request, thread_id, reported):
+        if self.registry.get(request.id) is not request:
+            # Request completed while the check was being started.
+            return
+
+        now = time.time()
+        reasons = []
+        if request.first_byte_at is None and now >= request.started + self.interval:
+            reasons.append('time to first byte')
+        if self.total_interval is not None and now >= request.started + self.total_interval:
+            reasons.append('total time')
+        if (self.stall_interval is not None and request.first_byte_at is not None
+                and now >= request.last_chunk_at + self.stall_interval):
+            reasons.append('stalled')
+        reasons = [r for r in reasons if r not in reported]
+
+        if reasons and self.saturation is not None and self.saturation.in_incident:
+            # Part of the saturation incident report, the request is reported
+            # on its own if it's still in progress once the saturation ends.
+            self._schedule_check(environ, request, thread_id, reported,
+                                 self.saturation.check_interval)
+            return
+
+        if reasons:
+            self.peek(environ, thread_id, dt.datetime.utcfromtimestamp(request.started),
+                      reasons, request)
+        self._schedule_check(environ, request, thread_id, reported.union(reasons))
 
     def _cancel_tracing(self, environ):
+        requests = environ.pop('BACKLASH_INFLIGHT_REQUESTS', [])
+        for request in requests:
+            self.registry.end(request)
+
         try:
-            tracing_jobs = environ.get('BACKLASH_SLOW_TRACING_JOBS', [])
-            for job in tracing_jobs:
-                self.timer.cancel(job)
+            # A check scheduled meanwhile finds the request completed and stops.
+            for request in requests:
+                for job in request.checks:
+                    self.timer.cancel(job)
         except Exception:
             error = get_current_traceback(skip=1, show_hidden_frames=False)
             environ['wsgi.errors'].write('Failed to cancel slow requests tracing timer\n')
@@ -0,0 +1,100 @@
+import datetime as dt
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from backlash.frtools import StackDump, get_frame_stack, get_greenlet_frame, stack_fingerprint
+from backlash.tracing.delivery import deliver
+from backlash.utils import RequestContext
+
+
+class SaturationWatchdog(object):
+    """Detects when most of the worker threads are stuck.
+
+    Every ``check_interval`` seconds the requests in progress in ``registry``
+    are compared to the ``capacity`` of the server (the number of worker
+    threads or greenlets).  When more than ``threshold`` of the workers are
+    busy for at least ``duration`` seconds a single incident is reported,
+    with the stacks of the busy workers grouped by the point of the
+    application they are at.  No other incident is reported until the saturation ends.
+    """
+
+    def __init__(self, timer, registry, reporters, capacity, threshold=0.9,
+                 duration=10, check_interval=1, group_depth=5):
+        self.timer = timer
+        self.registry = registry
+        self.reporters = reporters
+        self.capacity = capacity
+        self.threshold = threshold
+        self.duration = duration
+        self.check_interval = check_interval
+        self.group_depth = group_depth
+
+        self.saturated_since = None
+        self.in_incident = False
+        self.incidents = 0
+
+    def start(self):
+        self.timer.run_later(self.check, self.check_interval)
+
+    def check(self):
+        try:
+            self._check(time.time())
+        finally:
+            self.start()
+
+    def _check(self, now):
+        requests = self.registry.snapshot()
+        if len(requests) < self.capacity * self.threshold:
+            self.saturated_since = None
+            self.in_incident = False
+            return
+
+        if self.saturated_since is None:
+            self.saturated_since = now
+        if self.in_incident or now - self.saturated_since < self.duration:
+            return
+
+        self.in_incident = True
+        self.incidents += 1
+        self.report(self.capture(requests))
+
+    def capture(self, requests):
+        """Capture the stacks of the busy workers grouped by fingerprint."""
+        current_frames = sys._current_frames()
+        groups = OrderedDict()
+        for request in requests:
+            try:
+                if hasattr(request.task, 'greenlet'):
+                    f = get_greenlet_frame(request.task)
+                else:
+                    f = current_frames[request.thread_id]
+            except KeyError:
+                # Completed in the mean time.
+                continue
+            tb = get_frame_stack(f, request.path, error_type='SaturatedWorker')
+            groups.setdefault(stack_fingerprint(tb.frames, self.group_depth), []).append(
+                (request, tb)
+            )
+
+        stacks = []
+        for members in sorted(groups.values(), key=len, reverse=True):
+            oldest = min(members, key=lambda m: m[0].started)
+            label = '%d busy: %s' % (len(members), '; '.join(r.describe() for r, _ in members))
+            stacks.append((label, oldest[1]))
+
+        context = RequestContext({'environ': {}})
+        context.update({
+            'SATURATION': {'ProcessID': os.getpid(),
+                           'BusyWorkers': len(requests),
+                           'Capacity': self.capacity,
+                           'SaturatedSince': str(dt.datetime.utcfromtimestamp(self.saturated_since)),
+                           'DistinctStacks': len(stacks)}
+        })
+        return StackDump(stacks, '%d of %d workers busy for more than %ss' % (
+            len(requests), self.capacity, self.duration
+        ), error_type='WorkersSaturated', context=context)
+
+    def report(self, traceback):
+        deliver(self.reporters, traceback, sys.stderr, 'workers saturation')
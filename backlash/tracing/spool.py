@@ -0,0 +1,261 @@
+"""On disk spool of the reports that failed to be delivered.
+
+Reports that a reporter failed to deliver are appended, as events of
+:mod:`backlash.tracing.events`, to segment files in the spool directory
+and a background thread delivers them again to the same reporter once
+it recovers, backing off exponentially while it keeps failing.
+
+Segments are named after the process that writes them, so that multiple
+worker processes can share the same spool directory::
+
+    <started>-<pid>.open       segment being written by process <pid>
+    <started>-<pid>.spool      complete segment, waiting to be delivered
+    <started>-<pid>.<owner>    segment being delivered by process <owner>
+"""
+import errno
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+from backlash.tracing.events import serialize_traceback, EventTraceback
+
+log = logging.getLogger('backlash')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _parse_segment(name):
+    """Stem, state and owner process of a segment file, ``None`` for other files."""
+    stem, _, state = name.rpartition('.')
+    try:
+        writer = int(stem.split('-')[1])
+        owner = writer if state in ('open', 'spool') else int(state)
+    except (ValueError, IndexError):
+        return None
+    return stem, state, owner
+
+
+class Spool(object):
+    """Keeps the reports that failed to be delivered to ``reporters``.
+
+    Writes are flushed immediately and synced to disk at most every
+    ``fsync_interval`` seconds.  Segments are closed when they reach
+    ``segment_size`` bytes and the oldest ones are evicted when the spool
+    grows over ``max_bytes``.  Redelivery is retried after ``min_backoff``
+    seconds, doubling up to ``max_backoff`` while it keeps failing.
+
+    Reporters are identified by their position and class, so the same
+    spool directory must be used with the same list of reporters.
+    """
+
+    def __init__(self, directory, reporters, max_bytes=50 * 1024 * 1024,
+                 segment_size=1024 * 1024, fsync_interval=1.0, min_backoff=1, max_backoff=300):
+        self.directory = directory
+        self.reporters = reporters
+        self.max_bytes = max_bytes
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.spooled = 0
+        self.redelivered = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._segment = None
+        self._segment_path = None
+        self._dirty = False
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _reporter_key(self, reporter):
+        index = self.reporters.index(reporter)
+        name = type(getattr(reporter, 'reporter', reporter)).__name__
+        return '%d:%s' % (index, name)
+
+    def _find_reporter(self, key):
+        index, _, name = key.partition(':')
+        try:
+            reporter = self.reporters[int(index)]
+        except (ValueError, IndexError):
+            return None
+        if type(getattr(reporter, 'reporter', reporter)).__name__ != name:
+            return None
+        return reporter
+
+    def _ensure_started(self):
+        # Threads and open files don't survive forks of the process.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._segment = self._segment_path = None
+        self._dirty = False
+        thread = threading.Thread(target=self._run, name='backlash-spool')
+        thread.daemon = True
+        thread.start()
+
+    def store(self, reporter, traceback):
+        """Append the report of ``traceback`` for ``reporter`` to the spool."""
+        line = json.dumps({'reporter': self._reporter_key(reporter),
+                           'event': serialize_traceback(traceback)}) + '\n'
+        data = line.encode('utf-8')
+        with self._lock:
+            self._ensure_started()
+            if self._segment is None:
+                self._segment_path = os.path.join(self.directory, '%d-%d.open' % (
+                    time.time() * 1000000, os.getpid()
+                ))
+                self._segment = io.open(self._segment_path, 'ab')
+            self._segment.write(data)
+            self._segment.flush()
+            self._dirty = True
+            self.spooled += 1
+            if self._segment.tell() >= self.segment_size:
+                self._close_segment()
+        self._evict()
+
+    def _close_segment(self):
+        try:
+            os.fsync(self._segment.fileno())
+            self._segment.close()
+            try:
+                os.rename(self._segment_path, self._segment_path[:-len('.open')] + '.spool')
+            except OSError as e:
+                # Segment was removed by someone else, its reports are lost.
+                if e.errno != errno.ENOENT:
+                    raise
+        finally:
+            self._segment = self._segment_path = None
+            self._dirty = False
+
+    def _sync(self):
+        with self._lock:
+            if self._dirty and self._segment is not None:
+                os.fsync(self._segment.fileno())
+                self._dirty = False
+
+    def _segments(self):
+        """Segments in the spool directory, the oldest first."""
+        names = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                names.append((name, os.path.getsize(path)))
+            except OSError:
+                continue
+        names.sort()
+        return names
+
+    def _evict(self):
+        segments = [(name, size, _parse_segment(name)) for name, size in self._segments()]
+        # Temporary files are not counted as they can't be evicted.
+        segments = [(name, size, segment) for name, size, segment in segments
+                    if segment is not None]
+        total = sum(size for _, size, _ in segments)
+        for name, size, segment in segments:
+            if total <= self.max_bytes:
+                break
+            _, state, owner = segment
+            if state == 'open' and (owner == os.getpid() or _pid_alive(owner)):
+                # Still being written.
+                continue
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            self.evicted += 1
+
+    def _claim(self):
+        """Take ownership of the oldest segment ready for delivery."""
+        pid = os.getpid()
+        for name, _ in self._segments():
+            segment = _parse_segment(name)
+            if segment is None:
+                continue
+            stem, state, owner = segment
+            if state == 'open' and owner == pid:
+                continue
+            if state != 'spool' and owner != pid and _pid_alive(owner):
+                # Still being written or delivered by another process.
+                continue
+            claimed = os.path.join(self.directory, '%s.%d' % (stem, pid))
+            try:
+                os.rename(os.path.join(self.directory, name), claimed)
+            except OSError:
+                continue
+            return claimed
+        return None
+
+    def _redeliver(self, path):
+        """Deliver the reports of a claimed segment, True when all succeeded."""
+        with io.open(path, 'rb') as segment:
+            lines = segment.readlines()
+
+        for idx, line in enumerate(lines):
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                # Partially written by a process that crashed.
+                continue
+            reporter = self._find_reporter(record['reporter'])
+            if reporter is None:
+                continue
+            try:
+                reporter.report(EventTraceback(record['event']))
+            except Exception:
+                log.debug('Redelivery of spooled report to %s failed', reporter, exc_info=True)
+                # Keep only the reports that still have to be delivered.
+                with io.open(path + '.tmp', 'wb') as segment:
+                    segment.writelines(lines[idx:])
+                    segment.flush()
+                    os.fsync(segment.fileno())
+                os.rename(path + '.tmp', path)
+                return False
+            self.redelivered += 1
+
+        os.unlink(path)
+        return True
+
+    def _run(self):
+        backoff = self.min_backoff
+        next_delivery = time.time()
+        while True:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            try:
+                self._sync()
+                if time.time() < next_delivery:
+                    continue
+
+                with self._lock:
+                    if self._segment is not None:
+                        self._close_segment()
+
+                path = self._claim()
+                while path is not None:
+                    if not self._redeliver(path):
+                        break
+                    path = self._claim()
+
+                if path is None:
+                    backoff = self.min_backoff
+                    next_delivery = time.time() + self.min_backoff
+                else:
+                    next_delivery = time.time() + backoff
+                    backoff = min(backoff * 2, self.max_backoff)
+            except Exception:
+                log.exception('Error while delivering spooled reports')
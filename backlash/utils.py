@@ -1,5 +1,13 @@
-from backlash._compat import text_type, binary_type
+from backlash._compat import text_type, binary_type, string_types, native_
 from random import SystemRandom
+import fnmatch
+import hmac
+import re
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
 
 SALT_CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
@@ -37,6 +45,129 @@ def gen_salt(length):
         raise ValueError('requested salt of length <= 0')
     return ''.join(_sys_rng.choice(SALT_CHARS) for _ in range(length))
 
+def check_secret(provided, secret):
+    """Compare ``provided`` to ``secret`` in constant time, ``None`` never matches."""
+    if provided is None or not secret:
+        return False
+    return hmac.compare_digest(native_(provided).encode('utf-8'), native_(secret).encode('utf-8'))
+
 class RequestContext(dict):
     def __getattr__(self, attr):
         return self[attr]
+
+
+class EnvironSnapshot(Mapping):
+    """Read only copy of an environ holding only strings, sorted by key."""
+    __slots__ = ('_keys', '_values')
+
+    def __init__(self, items):
+        items = sorted(items)
+        self._keys = tuple(k for k, _ in items)
+        self._values = dict(items)
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return 'EnvironSnapshot(%r)' % self._values
+
+
+def _compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+
+
+class EnvironSnapshotPolicy(object):
+    """Decides which entries of the environ are kept by reports.
+
+    ``include`` and ``exclude`` are lists of keys, which can contain ``*``
+    wildcards, of the entries to keep or to drop.  With ``headers_only``
+    only the HTTP headers and the CGI variables are kept.  The values of
+    the entries matching ``redact`` are replaced by ``redacted_value``.
+
+    Strings longer than ``max_value_length`` are truncated and values that
+    are not strings or simple scalars are recorded just by their type, so
+    snapshots don't keep alive streams and framework objects.
+    """
+
+    def __init__(self, include=None, exclude=None, headers_only=False, redact=None,
+                 redacted_value='[redacted]', max_value_length=1024):
+        self._include = _compile_patterns(include)
+        self._exclude = _compile_patterns(exclude)
+        self._redact = _compile_patterns(redact)
+        self.headers_only = headers_only
+        self.redacted_value = redacted_value
+        self.max_value_length = max_value_length
+
+    def _keep(self, key):
+        if self.headers_only and key.upper() != key:
+            return False
+        if self._include is not None and not self._include(key):
+            return False
+        if self._exclude is not None and self._exclude(key):
+            return False
+        return True
+
+    def _value(self, key, value):
+        if self._redact is not None and self._redact(key):
+            return self.redacted_value
+        if isinstance(value, binary_type):
+            value = value.decode('latin-1')
+        elif isinstance(value, (bool, int, float, tuple)) or value is None:
+            value = repr(value)
+        elif not isinstance(value, string_types):
+            value = '<%s.%s object>' % (type(value).__module__, type(value).__name__)
+        if len(value) > self.max_value_length:
+            value = value[:self.max_value_length] + '...'
+        return value
+
+    def snapshot(self, environ):
+        """An :class:`EnvironSnapshot` of the entries kept by the policy.
+
+        Snapshots are taken from other threads while the request is still in
+        progress, so the environ is copied at once before being filtered.
+        """
+        environ = dict(environ)
+        return EnvironSnapshot((str(k), self._value(k, v)) for k, v in environ.items()
+                               if self._keep(k))
+
+
+#: Policy used when none is provided, keeps every entry.
+default_environ_policy = EnvironSnapshotPolicy()
+
+
+def environ_from_scope(scope):
+    """Build a WSGI like environ for an ASGI HTTP ``scope``.
+
+    Only plain strings are stored, so that reporters written for WSGI
+    can report ASGI requests too.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope.get('path', ''),
+        'QUERY_STRING': native_(scope.get('query_string', b'')),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': str(client[0]),
+        'wsgi.url_scheme': scope.get('scheme', 'http')
+    }
+    for name, value in scope.get('headers', []):
+        name = native_(name).upper().replace('-', '_')
+        value = native_(value)
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
@@ -0,0 +1,277 @@
+"""Microbenchmarks of the backlash hot paths.
+
+Covers the overhead added by each middleware to requests that succeed,
+scheduling and cancelling ``Timer`` jobs, capturing and rendering
+tracebacks, the debugger repr of large containers and the assembly of
+error emails.
+
+Each benchmark is calibrated to run for at least ``--min-time`` seconds
+and repeated ``--repeat`` times, the time of a single call is reported.
+Results can be saved as JSON and compared with the ones of another
+commit to tell whether a change made things slower.
+
+Run with::
+
+    python benchmarks/bench_hotpaths.py --json before.json
+    # ... apply changes ...
+    python benchmarks/bench_hotpaths.py --json after.json --compare before.json
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from backlash import DebuggedApplication, MemoryGrowthMiddleware, ProfilingMiddleware
+from backlash.repr import DebugReprGenerator
+from backlash.tbtools import get_current_traceback
+from backlash.tracing.errors import TraceErrorsMiddleware
+from backlash.tracing.reporters.mail import EmailReporter
+from backlash.tracing.slowrequests import TraceSlowRequestsMiddleware
+from backlash.tracing.slowrequests.timer import Timer
+from backlash.utils import RequestContext, default_environ_policy
+
+ENVIRON = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/users/42', 'QUERY_STRING': 'page=2',
+           'SERVER_NAME': 'localhost', 'SERVER_PORT': '8080', 'SERVER_PROTOCOL': 'HTTP/1.1',
+           'HTTP_HOST': 'localhost:8080', 'HTTP_USER_AGENT': 'bench/1.0',
+           'HTTP_ACCEPT': 'text/html', 'HTTP_COOKIE': 'session=0123456789abcdef',
+           'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+           'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+           'wsgi.run_once': False}
+
+
+def hello_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'Hello World']
+
+
+def streaming_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    yield b'Hello '
+    yield b'World'
+
+
+def _start_response(status, headers, exc_info=None):
+    pass
+
+
+def make_request(app):
+    def request():
+        result = app(dict(ENVIRON), _start_response)
+        if hasattr(result, '__len__'):
+            # Like waitress, to set Content-Length of single chunk responses.
+            len(result)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    return request
+
+
+def middleware_benchmarks():
+    stacks = [
+        ('bare', lambda app: app),
+        ('errors', lambda app: TraceErrorsMiddleware(app, [], [])),
+        ('slow', lambda app: TraceSlowRequestsMiddleware(app, [], [], interval=60)),
+        ('errors+slow', lambda app: TraceErrorsMiddleware(
+            TraceSlowRequestsMiddleware(app, [], [], interval=60), [], [])),
+        ('debugger', lambda app: DebuggedApplication(app)),
+        ('profiling', lambda app: ProfilingMiddleware(app, 'secret', sample_rate=0)),
+        ('profiling.sampled', lambda app: ProfilingMiddleware(app, 'secret', sample_rate=1)),
+        ('memory', lambda app: MemoryGrowthMiddleware(app, [], [], sample_rate=0)),
+        ('memory.sampled', lambda app: MemoryGrowthMiddleware(app, [], [], sample_rate=1)),
+    ]
+    for app_name, app in (('list', hello_app), ('generator', streaming_app)):
+        for stack_name, wrap in stacks:
+            yield 'middleware.%s.%s' % (stack_name, app_name), make_request(wrap(app))
+
+
+def timer_benchmarks():
+    for pending in (0, 100, 1000, 10000):
+        # The timer thread is not started, jobs are only queued.
+        timer = Timer()
+        for _ in range(pending):
+            timer.run_later(_noop, 3600)
+
+        def schedule_and_cancel(timer=timer):
+            timer.cancel(timer.run_later(_noop, 60))
+        yield 'timer.schedule_cancel.pending_%d' % pending, schedule_and_cancel
+
+
+def _noop():
+    pass
+
+
+def _raise_at_depth(depth):
+    if depth <= 1:
+        raise ValueError('failure at the bottom of the stack')
+    _raise_at_depth(depth - 1)
+
+
+def capture_exc_info(depth):
+    try:
+        _raise_at_depth(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def request_context():
+    return RequestContext({'environ': default_environ_policy.snapshot(ENVIRON)})
+
+
+def traceback_benchmarks():
+    for depth in (10, 50, 200):
+        exc_info = capture_exc_info(depth)
+
+        def capture(exc_info=exc_info):
+            get_current_traceback(exc_info=exc_info, context=request_context())
+        yield 'traceback.capture.depth_%d' % depth, capture
+
+    for depth in (10, 50):
+        traceback = get_current_traceback(exc_info=capture_exc_info(depth),
+                                          context=request_context())
+        yield 'traceback.plaintext.depth_%d' % depth, lambda tb=traceback: tb.plaintext
+        yield 'traceback.render_full.depth_%d' % depth, lambda tb=traceback: tb.render_full()
+
+
+def repr_benchmarks():
+    containers = [
+        ('list_10000', list(range(10000))),
+        ('dict_10000', dict(('key%d' % i, i) for i in range(10000))),
+        ('set_10000', set(range(10000))),
+        ('nested_1000', [{'id': i, 'name': 'user%d' % i, 'tags': ['a', 'b', 'c']}
+                         for i in range(1000)]),
+        ('string_100000', 'x' * 100000),
+    ]
+    for name, obj in containers:
+        yield 'repr.%s' % name, lambda obj=obj: DebugReprGenerator().repr(obj)
+
+
+def email_benchmarks():
+    traceback = get_current_traceback(exc_info=capture_exc_info(20), context=request_context())
+    reporters = [
+        ('plain', EmailReporter(smtp_server='localhost', from_address='backlash@localhost',
+                                error_email='errors@localhost')),
+        ('dump_all', EmailReporter(smtp_server='localhost', from_address='backlash@localhost',
+                                   error_email='errors@localhost', dump_request=True,
+                                   dump_local_frames=True)),
+    ]
+    for name, reporter in reporters:
+        yield ('email.assemble.%s' % name,
+               lambda reporter=reporter: reporter.assemble_email(traceback))
+
+
+BENCHMARKS = [middleware_benchmarks, timer_benchmarks, traceback_benchmarks,
+              repr_benchmarks, email_benchmarks]
+
+
+def calibrate(func, min_time):
+    """Number of loops needed for a run to last at least ``min_time`` seconds."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return loops
+        loops *= 2
+
+
+def measure(func, repeat, min_time):
+    """Seconds taken by a single call of ``func`` in each run."""
+    loops = calibrate(func, min_time)
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        runs.append((time.perf_counter() - start) / loops)
+    return {'loops': loops,
+            'runs': runs,
+            'min': min(runs),
+            'median': statistics.median(runs),
+            'mean': statistics.mean(runs),
+            'stdev': statistics.stdev(runs) if len(runs) > 1 else 0.0}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def compare(results, baseline):
+    """Print the change of the median time of the benchmarks found in both."""
+    print('')
+    print('Compared to %s' % (baseline['metadata'].get('commit') or 'baseline'))
+    for name, stats in results.items():
+        previous = baseline['benchmarks'].get(name)
+        if previous is None:
+            continue
+        change = stats['median'] / previous['median'] - 1
+        print('%-45s %12s -> %12s %+7.1f%%' % (name, format_time(previous['median']),
+                                               format_time(stats['median']), change * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the backlash hot paths.')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run the benchmarks whose name contains this string')
+    parser.add_argument('--repeat', type=int, default=7, help='runs of each benchmark')
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='minimum duration of a run, in seconds')
+    parser.add_argument('--json', help='save the results as JSON in this file')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    options = parser.parse_args()
+
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for group in BENCHMARKS:
+        for name, func in group():
+            if options.filter not in name:
+                continue
+            stats = results[name] = measure(func, options.repeat, options.min_time)
+            print('%-45s %12s +- %s' % (name, format_time(stats['median']),
+                                        format_time(stats['stdev'])))
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'metadata': {'commit': git_commit(),
+                                    'date': datetime.datetime.utcnow().isoformat(),
+                                    'python': platform.python_version(),
+                                    'implementation': platform.python_implementation(),
+                                    'platform': platform.platform(),
+                                    'repeat': options.repeat,
+                                    'min_time': options.min_time},
+                       'benchmarks': results}, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == '__main__':
+    main()
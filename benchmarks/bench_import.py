@@ -0,0 +1,68 @@
+"""Import time of the backlash entry points, measured with ``-X importtime``.
+
+Each entry point is imported in a fresh interpreter and the cumulative
+time of its import is reported together with the modules of the
+interactive debugger that it loaded.  The tracing middlewares must not
+load any of them, the script exits with an error if they do.
+
+Run with::
+
+    python benchmarks/bench_import.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#: Modules only needed by the interactive debugger.
+DEBUGGER_MODULES = ('backlash.console', 'backlash.repr', 'backlash.debug', 'webob')
+
+ENTRY_POINTS = [
+    ('backlash', 'import backlash', False),
+    ('errors', 'from backlash import TraceErrorsMiddleware', False),
+    ('slowrequests', 'from backlash import TraceSlowRequestsMiddleware', False),
+    ('profiling', 'from backlash import ProfilingMiddleware', False),
+    ('debugger', 'from backlash import DebuggedApplication', True),
+]
+
+
+def importtime(statement, repeat=5):
+    """Best cumulative import time in microseconds and the modules imported."""
+    best = None
+    modules = set()
+    for _ in range(repeat):
+        env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE='')
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                                env=env, stderr=subprocess.PIPE, check=True,
+                                universal_newlines=True).stderr
+        total = 0
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            modules.add(name.strip())
+            if not name[1:].startswith(' '):
+                # Top level imports include the time of their own imports.
+                total += int(cumulative)
+        best = total if best is None else min(best, total)
+    return best, modules
+
+
+def main():
+    failed = False
+    for name, statement, debugger in ENTRY_POINTS:
+        total, modules = importtime(statement)
+        loaded = sorted(m for m in DEBUGGER_MODULES if m in modules)
+        print('%-14s %8.1f ms   debugger modules: %s' % (name, total / 1000.0,
+                                                          ', '.join(loaded) or '-'))
+        if loaded and not debugger:
+            failed = True
+
+    if failed:
+        print('Tracing middlewares loaded the interactive debugger')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Delivery of reports by the HTTP reporters to a local stand-in server.
+
+The server decodes and counts the events it receives and can be told to
+answer the first requests with an error, so the script also checks that
+webhook events are delivered once each, retried on server errors and not
+retried on client errors, that reports fail fast once the endpoint is
+unavailable, and that Sentry events refused because of rate
+limits are sent again once the limit expires, with the exception message
+and not its type as value.
+
+Run with::
+
+    python benchmarks/bench_reporters.py
+"""
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backlash.tbtools import get_current_traceback
+from backlash.tracing.events import EventTraceback, serialize_traceback
+from backlash.tracing.reporters.sentry import SentryRateLimited, SentryReporter
+from backlash.tracing.reporters.webhook import WebhookReporter, WebhookUnavailable
+from backlash.utils import RequestContext
+
+EVENTS = 2000
+SENTRY_EVENTS = 200
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, failures=0, status=503, retry_after=None):
+        with self.lock:
+            self.events = 0
+            self.values = set()
+            self.retry_after = retry_after
+            self.requests = 0
+            self.connections = set()
+            self.failures = failures
+            self.failure_status = status
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/events' % self.server_address[1]
+
+    @property
+    def dsn(self):
+        return 'http://public@127.0.0.1:%d/42' % self.server_address[1]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            failing = server.failures > 0
+            if failing:
+                server.failures -= 1
+            elif self.path.startswith('/api/'):
+                event = json.loads(body.splitlines()[2].decode('utf-8'))
+                server.values.update(v['value'] for v in event['exception']['values'])
+                server.events += 1
+            else:
+                server.events += len(json.loads(gzip.decompress(body).decode('utf-8')))
+        self.send_response(server.failure_status if failing else 202)
+        if failing and server.retry_after is not None:
+            self.send_header('Retry-After', str(server.retry_after))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def make_traceback():
+    try:
+        raise ValueError('benchmark')
+    except ValueError:
+        return get_current_traceback(context=RequestContext({'environ': {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/bench'
+        }}))
+
+
+def bench_webhook(server, traceback, failures=0, status=503):
+    server.reset(failures, status)
+    reporter = WebhookReporter(server.url, backoff=0.01, flush_interval=0.05,
+                               max_queue=EVENTS)
+    reporter.refused = 0
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        try:
+            reporter.report(traceback)
+        except WebhookUnavailable:
+            reporter.refused += 1
+    queued = time.perf_counter() - start
+    reporter.flush()
+    elapsed = time.perf_counter() - start
+
+    print('webhook %-22s %6.1f us/report queued, %7.0f events/s delivered, '
+          '%d requests over %d connections' % (
+              '(%d x %d)' % (failures, status) if failures else '', queued / EVENTS * 1e6,
+              EVENTS / elapsed, server.requests, len(server.connections)))
+    return reporter
+
+
+def bench_sentry(server, traceback, failures=0, retry_after=None):
+    server.reset(failures, 429, retry_after)
+    reporter = SentryReporter(server.dsn, max_queue=SENTRY_EVENTS)
+    start = time.perf_counter()
+    for _ in range(SENTRY_EVENTS):
+        try:
+            reporter.report(traceback)
+        except SentryRateLimited:
+            pass
+    queued = time.perf_counter() - start
+    reporter.flush()
+    elapsed = time.perf_counter() - start
+
+    print('sentry  %-22s %6.1f us/report queued, %7.0f events/s delivered, '
+          '%d requests over %d connections' % (
+              '(%d x 429)' % failures if failures else '', queued / SENTRY_EVENTS * 1e6,
+              SENTRY_EVENTS / elapsed, server.requests, len(server.connections)))
+    return reporter
+
+
+def main():
+    server = StandInServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    traceback = make_traceback()
+
+    try:
+        reporter = bench_webhook(server, traceback)
+        assert server.events == EVENTS and reporter.dropped == 0
+
+        # Server errors are retried.
+        reporter = bench_webhook(server, traceback, failures=2, status=503)
+        assert server.events == EVENTS and reporter.dropped == 0
+
+        # Client errors are not, the events of the refused batch are dropped
+        # and the following reports fail right away.
+        reporter = bench_webhook(server, traceback, failures=1, status=400)
+        assert server.events + reporter.dropped + reporter.refused == EVENTS
+        assert reporter.dropped > 0 and reporter.refused > 0
+
+        # While the endpoint is unavailable reports fail without network activity.
+        reporter = WebhookReporter('http://127.0.0.1:1/events', retries=0)
+        reporter.report(traceback)
+        reporter.flush()
+        start = time.perf_counter()
+        for _ in range(EVENTS):
+            try:
+                reporter.report(traceback)
+            except WebhookUnavailable:
+                pass
+        elapsed = time.perf_counter() - start
+        print('webhook %-22s %6.1f us/report refused' % ('(unavailable)',
+                                                         elapsed / EVENTS * 1e6))
+        assert reporter.failing and elapsed < 1
+
+        # Events refused by rate limits are sent again after Retry-After.
+        for tb in (traceback, EventTraceback(serialize_traceback(traceback))):
+            reporter = bench_sentry(server, tb)
+            assert server.events == SENTRY_EVENTS and reporter.dropped == 0
+            assert server.values == set(['benchmark'])
+
+            # The events reported while rate limited are dropped.
+            reporter = bench_sentry(server, tb, failures=1, retry_after=0.2)
+            assert server.events + reporter.dropped == SENTRY_EVENTS
+            assert server.requests == server.events + 1
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Throughput of large responses streamed through the backlash middlewares.
+
+Each case serves a response body through a minimal server loop that
+behaves like real servers do: ``wsgi.file_wrapper`` responses are sent
+with ``sendfile``, anything else is iterated chunk by chunk.
+
+Run with::
+
+    python benchmarks/bench_streaming.py
+"""
+import os
+import sys
+import tempfile
+import time
+from wsgiref.util import FileWrapper
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from backlash.tracing.errors import TraceErrorsMiddleware
+from backlash.tracing.slowrequests import TraceSlowRequestsMiddleware
+
+BODY_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+CHUNK = b'x' * CHUNK_SIZE
+
+
+def list_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+    return [CHUNK] * (BODY_SIZE // CHUNK_SIZE)
+
+
+def generator_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+    for _ in range(BODY_SIZE // CHUNK_SIZE):
+        yield CHUNK
+
+
+def make_file_app(path):
+    def file_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/octet-stream')])
+        return environ['wsgi.file_wrapper'](open(path, 'rb'), CHUNK_SIZE)
+    return file_app
+
+
+def serve(app, sink):
+    """Serve a single request, returning the number of bytes sent."""
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/download',
+               'QUERY_STRING': '', 'wsgi.errors': sys.stderr,
+               'wsgi.file_wrapper': FileWrapper}
+    result = app(environ, lambda status, headers, exc_info=None: None)
+    sent = 0
+    try:
+        if isinstance(result, FileWrapper):
+            filelike = result.filelike
+            offset, size = 0, os.fstat(filelike.fileno()).st_size
+            while offset < size:
+                offset += os.sendfile(sink, filelike.fileno(), offset, size - offset)
+            sent = offset
+        else:
+            for chunk in result:
+                os.write(sink, chunk)
+                sent += len(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return sent
+
+
+def measure(app, sink, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sent = serve(app, sink)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return sent / best / (1024 * 1024)
+
+
+def wrap(app, middlewares):
+    if 'errors' in middlewares:
+        app = TraceErrorsMiddleware(app, [], [])
+    if 'slow' in middlewares:
+        app = TraceSlowRequestsMiddleware(app, [], [], interval=60)
+    return app
+
+
+def main():
+    with tempfile.NamedTemporaryFile() as body:
+        body.write(b'x' * BODY_SIZE)
+        body.flush()
+
+        apps = [('list', list_app), ('generator', generator_app),
+                ('file_wrapper', make_file_app(body.name))]
+        stacks = [('bare', ()), ('errors', ('errors', )), ('slow', ('slow', )),
+                  ('errors+slow', ('errors', 'slow'))]
+
+        sink = os.open(os.devnull, os.O_WRONLY)
+        try:
+            for app_name, app in apps:
+                for stack_name, middlewares in stacks:
+                    throughput = measure(wrap(app, middlewares), sink)
+                    print('%-14s %-12s %10.1f MB/s' % (app_name, stack_name, throughput))
+        finally:
+            os.close(sink)
+
+
+if __name__ == '__main__':
+    main()